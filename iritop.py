@@ -2,16 +2,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import division
 import argparse
+import bisect
 import re
+import math
 import sys
 import time
 import json
-import yaml
 import random
+import select
+import signal
+import socket
 import base64
-from subprocess import check_output
-from os import (path, environ, getloadavg, getenv)
-from curses import wrapper
+import csv
+import errno
+import zlib
+import threading
+from array import array
+from collections import (namedtuple, OrderedDict, deque)
+from os import (path, environ, getloadavg, getenv, pipe, read, write,
+                close, dup2, devnull, O_NONBLOCK, O_WRONLY)
+from os import open as os_open
 
 
 __VERSION__ = '0.5.5'
@@ -31,32 +41,100 @@ https://github.com/maeck70/iritop
 
 
 try:
-    import urllib3
+    from urlparse import urlparse  # python 2
 except ImportError:
-    sys.stderr.write("Missing python urllib3? " +
-                     "Install via 'pip install urllib3'"
-                     "\n")
-    sys.exit(1)
+    from urllib.parse import urlparse  # python 3
 
 try:
-    from blessed import Terminal
+    import fcntl
 except ImportError:
-    sys.stderr.write("Missing python blessed package? Install via 'pip install"
-                     " blessed'\n")
-    sys.exit(1)
+    fcntl = None  # windows
 
 try:
-    from urlparse import urlparse  # python 2
+    import Queue as queue  # python 2
 except ImportError:
-    from urllib.parse import urlparse  # python 3
+    import queue  # python 3
 
 
 # Url request timeout
 URL_TIMEOUT = 5
 
+# Keep-alive connection pool to the node
+POOL_SIZE = 2
+RETRIES = 0
+
+# Max poller threads in fleet mode
+WORKERS = 64
+
+# A command answering slower than this (ms) or failing is polled at
+# up to twice its interval per poll, up to BACKOFF_MAX seconds, give
+# or take BACKOFF_JITTER. Healthy answers halve it back.
+SLOW_LATENCY = 1000
+BACKOFF_MAX = 60
+BACKOFF_JITTER = 0.1
+
+# After this many failed polls in a row, only one command at a time
+# probes the node until it answers again
+BREAKER_FAILURES = 5
+
+# Polls after which state of a neighbor that went away is dropped
+NEIGHBOR_TTL = 30
+MAX_TRACKED_NEIGHBORS = 10000
+
+# The commands sent in the query to the node
+COMMANDS = [{'command': 'getNeighbors'},
+            {'command': 'getNodeInfo'}]
+
+# getNodeInfo fields exported as gauges: key, metric, help
+NODE_METRICS = [('latestMilestoneIndex', 'iri_latest_milestone_index',
+                 'Latest milestone index'),
+                ('latestSolidSubtangleMilestoneIndex',
+                 'iri_latest_solid_subtangle_milestone_index',
+                 'Latest solid subtangle milestone index'),
+                ('tips', 'iri_tips', 'Number of tips'),
+                ('transactionsToRequest', 'iri_transactions_to_request',
+                 'Transactions waiting to be requested'),
+                ('neighbors', 'iri_neighbors', 'Number of neighbors'),
+                ('jreFreeMemory', 'iri_jre_free_memory_bytes',
+                 'JRE free memory'),
+                ('jreTotalMemory', 'iri_jre_total_memory_bytes',
+                 'JRE total memory'),
+                ('jreMaxMemory', 'iri_jre_max_memory_bytes',
+                 'JRE max memory')]
+
+# Upper bounds of the fetch latency histogram, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Session recording: file magic and seconds of polls per block
+RECORD_MAGIC = b'IRIREC1\n'
+RECORD_INTERVAL = 120
+
+# Replay speed and seconds skipped by the < and > keys
+REPLAY_SPEED = 1
+REPLAY_STEP = 300
+
+# Cycles of a --profile run unless MAX_CYCLES says otherwise, and
+# seconds between stack samples
+PROFILE_CYCLES = 10
+PROFILE_INTERVAL = 0.005
+
+# Neighbor tx counters
+COUNTERS = ['numberOfAllTransactions',
+            'numberOfNewTransactions',
+            'numberOfSentTransactions',
+            'numberOfRandomTransactionRequests',
+            'numberOfInvalidTransactions',
+            'numberOfStaleTransactions']
+
+# Headless output formats
+FORMATS = ['jsonl', 'csv']
+
 # Default node URL
 NODE = "http://localhost:14265"
 
+# Addresses of this host, see local_addresses()
+LOCAL_ADDRESSES = None
+
 # Headers for HTTP call
 HEADERS = {'Content-Type': 'application/json',
            'Accept-Charset': 'UTF-8',
@@ -70,11 +148,26 @@ POLL_DELAY = 2
 OBSCURE_TOGGLE = 0
 ITER = 0
 MB = 1024 * 1024
+
+# Widest integer array type, 'q' is python 3 only
+try:
+    INT_TYPECODE = array('q').typecode
+except ValueError:
+    INT_TYPECODE = 'l'
 EXIT_MSG = ""
+
+# Clock for poll intervals, python 2 only has wall time
+monotonic = getattr(time, 'monotonic', time.time)
 MAX_CYCLES = getenv('MAX_CYCLES', '0')
 
+# Synchronized update (DEC mode 2026): the terminal holds back
+# rendering until the whole frame has been received
+SYNC_BEGIN = '\x1b[?2026h'
+SYNC_END = '\x1b[?2026l'
+NO_SYNC_TERMS = ('dumb', 'linux', 'vt', 'ansi', 'cons')
+
 
-def parse_args():
+def parse_args(argv=None):
     global NODE
     global BLINK_DELAY
     global POLL_DELAY
@@ -89,6 +182,8 @@ def parse_args():
                ' For the configuration keys omit prefix hyphen - or --, and'
                ' replace all other instances of - with _')
 
+    parser.set_defaults(nodes=None)
+
     parser.add_argument('--version', '-v', action='version',
                         version='iritop %s' % __VERSION__)
 
@@ -96,19 +191,96 @@ def parse_args():
                         help="configuration file. Defaults to ~/.iritop",
                         action=LoadFromFile)
 
-    parser.add_argument("-n", "--node", type=url,
-                        help="set the node we are connecting with. Default: " +
-                              NODE)
+    parser.add_argument("-n", "--node", type=url, action=NodeAction,
+                        help="set the node we are connecting with. Repeat to"
+                             " monitor a fleet of nodes. Default: " + NODE)
+
+    parser.add_argument("-w", "--workers", type=int,
+                        help="Max concurrent node polls in fleet mode."
+                             " Default: %s" % WORKERS)
 
     parser.add_argument("-p", "--poll-delay", type=int,
                         help="node poll delay. Default: %ss" % POLL_DELAY)
 
+    parser.add_argument("-i", "--interval", type=interval, action='append',
+                        help="Poll interval of one command, e.g."
+                             " getNeighbors=5. Repeat for each command."
+                             " Default: poll delay")
+
     parser.add_argument("-b", "--blink-delay", type=float,
                         help="blink delay. Default: %ss" % BLINK_DELAY)
 
     parser.add_argument("-t", "--url-timeout", type=int,
                         help="URL Timeout. Default: %ss" % URL_TIMEOUT)
 
+    parser.add_argument("--connect-timeout", type=float,
+                        help="URL connect timeout. Default: URL Timeout")
+
+    parser.add_argument("--read-timeout", type=float,
+                        help="URL read timeout. Default: URL Timeout")
+
+    parser.add_argument("--pool-size", type=int,
+                        help="Max keep-alive connections to the node."
+                             " Default: %s" % POOL_SIZE)
+
+    parser.add_argument("--retries", type=int,
+                        help="Retries per node call. Default: %s" % RETRIES)
+
+    parser.add_argument("--neighbor-ttl", type=int,
+                        help="Polls after which a neighbor that went away is"
+                             " forgotten. Default: %s" % NEIGHBOR_TTL)
+
+    parser.add_argument("--max-tracked-neighbors", type=int,
+                        help="Max neighbors to keep state for. Default: %s" %
+                             MAX_TRACKED_NEIGHBORS)
+
+    parser.add_argument("--headless", action='store_true',
+                        help="Write one record per poll instead of showing"
+                             " the terminal view")
+
+    parser.add_argument("--format", choices=FORMATS,
+                        help="Headless output format. Default: %s" %
+                             FORMATS[0])
+
+    parser.add_argument("--output", type=str,
+                        help="Headless output file to append to."
+                             " Default: stdout")
+
+    parser.add_argument("--export-port", type=int,
+                        help="Serve Prometheus metrics on this port."
+                             " Default: Off")
+
+    parser.add_argument("--record", type=str,
+                        help="Append every poll to this session file."
+                             " Default: Off")
+
+    parser.add_argument("--replay", type=str,
+                        help="Show a session file or JSON Lines capture"
+                             " instead of polling the node")
+
+    parser.add_argument("--speed", type=float,
+                        help="Replay speed. Default: %sx" % REPLAY_SPEED)
+
+    parser.add_argument("--seek-time", type=duration,
+                        help="Start the replay this long after the start of"
+                             " the recording, e.g. 20h or 1h30m")
+
+    parser.add_argument("--seek-milestone", type=int,
+                        help="Start the replay at this milestone index")
+
+    parser.add_argument("--stats", action='store_true',
+                        help="Report the wakeups per second on exit")
+
+    parser.add_argument("--profile", type=str,
+                        help="Profile %s cycles (or MAX_CYCLES) and write"
+                             " the pstats to this file and collapsed stacks"
+                             " for flame graphs to <file>.folded" %
+                             PROFILE_CYCLES)
+
+    parser.add_argument("--timings", type=str,
+                        help="Write the time spent per phase to this JSON"
+                             " file on exit. Default: Off")
+
     parser.add_argument("-o", "--obscure-address", action='store_true',
                         help="Obscure addresses. Default: Off")
 
@@ -121,12 +293,14 @@ def parse_args():
     parser.add_argument("-s", "--sort", type=int,
                         help="Sort column # (-# for reverse sorting)")
 
-    # Get configuration file if exists
-    home_dir = path.expanduser("~")
-    if path.isfile(home_dir + '/.iritop'):
-        sys.argv.extend(['-c', home_dir + '/.iritop'])
+    # Get configuration file if exists, unless given the arguments
+    if argv is None:
+        argv = sys.argv[1:]
+        home_dir = path.expanduser("~")
+        if path.isfile(home_dir + '/.iritop'):
+            argv = argv + ['-c', home_dir + '/.iritop']
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Check if both username and password are set
     if ((args.username and not args.password) or
@@ -142,8 +316,27 @@ def parse_args():
         args.poll_delay = POLL_DELAY
     if args.obscure_address is None:
         args.obscure_address = OBSCURE_TOGGLE
+    if args.url_timeout is not None:
+        URL_TIMEOUT = args.url_timeout
+    if args.pool_size is None:
+        args.pool_size = POOL_SIZE
+    if args.retries is None:
+        args.retries = RETRIES
+    if args.format is None:
+        args.format = FORMATS[0]
+    args.intervals = dict(args.interval or [])
+    if args.speed is None:
+        args.speed = REPLAY_SPEED
+    if args.neighbor_ttl is None:
+        args.neighbor_ttl = NEIGHBOR_TTL
+    if args.max_tracked_neighbors is None:
+        args.max_tracked_neighbors = MAX_TRACKED_NEIGHBORS
     if args.node is not None:
         NODE = args.node
+    if args.nodes is None:
+        args.nodes = [NODE]
+    if args.workers is None:
+        args.workers = min(len(args.nodes), WORKERS)
 
     return args
 
@@ -159,9 +352,19 @@ class LoadFromFile(argparse.Action):
             if getattr(namespace, k) is not None:
                 continue
 
-            # Parse key values as arguments
+            # Parse key values as arguments, lists as repeated arguments
             k = '--' + k.replace('_', '-')
-            parser.parse_args((k, str(v)), namespace=namespace)
+            for item in (v if isinstance(v, list) else [v]):
+                parser.parse_args((k, str(item)), namespace=namespace)
+
+
+class NodeAction(argparse.Action):
+    """ Repeatable --node, the first node given is the default node """
+    def __call__(self, parser, namespace, values, option_string=None):
+        nodes = list(getattr(namespace, 'nodes', None) or [])
+        nodes.append(values)
+        namespace.nodes = nodes
+        namespace.node = nodes[0]
 
 
 letterPairs = [[ord('A'), ord('Z')],
@@ -197,14 +400,209 @@ def main():
         sys.stderr.write("Error parsing arguments: %s\n" % e)
         sys.exit(1)
 
+    try:
+        if args.profile is not None:
+            profile(args)
+        else:
+            run(args)
+    finally:
+        if args.timings is not None:
+            TIMINGS.dump(args.timings)
+
+
+def profile(args):
+    """
+    Run a bounded session under cProfile, which sees the main thread,
+    and the Sampler, which sees the poll threads as well.
+    """
+    import cProfile
+    global MAX_CYCLES
+    if int(MAX_CYCLES) == 0:
+        MAX_CYCLES = PROFILE_CYCLES
+
+    profiler = cProfile.Profile()
+    sampler = Sampler()
+    sampler.start()
+    profiler.enable()
+    try:
+        run(args)
+    finally:
+        profiler.disable()
+        sampler.stop()
+        profiler.dump_stats(args.profile)
+        sampler.write(args.profile + '.folded')
+
+
+def run(args):
+    # Headless mode never touches the terminal
+    if args.headless:
+        Headless(args).run()
+        return
+
+    replayer = None
+    if args.replay is not None:
+        try:
+            replayer = Replayer(open_recording(args.replay),
+                                speed=args.speed, node=args.node)
+        except (IOError, ValueError) as e:
+            sys.stderr.write("Error opening replay: %s\n" % e)
+            sys.exit(1)
+        if args.seek_time is not None:
+            replayer.seek(time=replayer.start_time + args.seek_time)
+        if args.seek_milestone is not None:
+            replayer.seek(milestone=args.seek_milestone)
+
+    from curses import wrapper
+
     # Force set locale to ensure blessed term
     # also works when those are missing
     environ['LC_ALL'] = 'en_US.UTF-8'
     environ['LC_CTYPE'] = 'en_US.UTF-8'
 
-    iri_top = IriTop(args)
+    if replayer is not None:
+        iri_top = IriTop(args, node=replayer.url, poller=replayer)
+    elif len(args.nodes) > 1:
+        iri_top = FleetTop(args)
+    else:
+        iri_top = IriTop(args)
     wrapper(iri_top.run)
 
+    if args.stats:
+        sys.stderr.write("Wakeups: %s\n" % iri_top.events.stats())
+
+
+def terminal(**kwargs):
+    """ Instantiate a blessed Terminal, imported only when needed """
+    try:
+        from blessed import Terminal
+    except ImportError:
+        sys.stderr.write("Missing python blessed package? Install via 'pip"
+                         " install blessed'\n")
+        sys.exit(1)
+    return Terminal(**kwargs)
+
+
+def report_error(where, e):
+    """ Report an error of a background thread, which carries on """
+    sys.stderr.write("Error in %s: %s: %s\n" % (where, type(e).__name__, e))
+
+
+def load_urllib3():
+    """ Import urllib3 on first use, --help and --version never need it """
+    try:
+        import urllib3
+    except ImportError:
+        sys.stderr.write("Missing python urllib3? " +
+                         "Install via 'pip install urllib3'"
+                         "\n")
+        sys.exit(1)
+    return urllib3
+
+
+def canonical_address(host):
+    """ IPv6 addresses in their compressed form, other hosts as given """
+    if ':' not in host:
+        return host
+    try:
+        return socket.inet_ntop(socket.AF_INET6,
+                                socket.inet_pton(socket.AF_INET6,
+                                                 host.split('%')[0]))
+    except (socket.error, ValueError, AttributeError):
+        return host
+
+
+def interface_addresses():
+    """
+    Addresses of all network interfaces from /proc, as hostname
+    --all-ip-addresses lists them. Empty where there is no /proc.
+    """
+    addresses = set()
+    try:
+        with open('/proc/net/fib_trie') as f:
+            address = None
+            for line in f:
+                if line.strip().startswith('|--'):
+                    address = line.split()[-1]
+                elif '/32 host LOCAL' in line and address is not None:
+                    addresses.add(address)
+    except IOError:
+        pass
+    try:
+        with open('/proc/net/if_inet6') as f:
+            for line in f:
+                hexa = line.split()[0]
+                addresses.add(canonical_address(':'.join(
+                    hexa[i:i + 4] for i in range(0, 32, 4))))
+    except (IOError, IndexError):
+        pass
+    return addresses
+
+
+def local_addresses():
+    """
+    Name and addresses of this host, looked up in-process once and
+    cached, without resolving any name: the addresses of the network
+    interfaces, plus the source address of the default IPv4 and IPv6
+    routes for systems without /proc. Connecting a UDP socket picks
+    the route without sending anything.
+    """
+    global LOCAL_ADDRESSES
+    if LOCAL_ADDRESSES is not None:
+        return LOCAL_ADDRESSES
+
+    addresses = set(['localhost', '127.0.0.1', '::1'])
+    addresses.add(socket.gethostname().lower())
+    addresses.update(interface_addresses())
+    for family, probe in [(socket.AF_INET, '192.0.2.1'),
+                          (socket.AF_INET6, '2001:db8::1')]:
+        try:
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+        except socket.error:
+            continue
+        try:
+            sock.connect((probe, 9))
+            addresses.add(canonical_address(sock.getsockname()[0]))
+        except socket.error:
+            pass
+        finally:
+            sock.close()
+
+    LOCAL_ADDRESSES = frozenset(addresses)
+    return LOCAL_ADDRESSES
+
+
+def is_local(host):
+    """ True if host is this host, loopback needs no lookup """
+    if host is None:
+        return False
+    if (host in ['localhost', '0.0.0.0', '::', '::1'] or
+            host.startswith('127.')):
+        return True
+    return canonical_address(host) in local_addresses()
+
+
+def interval(value):
+    """ command=seconds """
+    command, _, seconds = value.partition('=')
+    if command not in [c['command'] for c in COMMANDS]:
+        raise argparse.ArgumentTypeError("Unknown command %s" % command)
+    try:
+        seconds = float(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid interval %s" % value)
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError("Invalid interval %s" % value)
+    return command, seconds
+
+
+def duration(value):
+    """ Seconds in a duration like 90, 45s, 20h or 1h30m """
+    match = re.match(r'^(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s?)?$', value)
+    if not value or match is None:
+        raise argparse.ArgumentTypeError("Invalid duration")
+    hours, minutes, seconds = [int(g or 0) for g in match.groups()]
+    return hours * 3600 + minutes * 60 + seconds
+
 
 def url(url):
     regex = re.compile(
@@ -225,9 +623,15 @@ def url(url):
 
 
 def read_config(config_file):
+    try:
+        import yaml
+    except ImportError:
+        raise Exception("Missing python yaml to read configuration file"
+                        " '%s'? Install via 'pip install pyyaml'" %
+                        config_file)
     with open(config_file) as fh:
         try:
-            data = yaml.load(fh)
+            data = yaml.safe_load(fh)
         except yaml.parser.ParserError as e:
             raise Exception("Error parsing yaml configuration file '%s': %s" %
                             (config_file, e))
@@ -237,35 +641,1138 @@ def read_config(config_file):
     return data
 
 
+class Timings:
+
+    """
+    Time spent in each phase of polling and drawing, on the monotonic
+    clock: count, total, max and last seconds per phase. A phase costs
+    two clock reads and a locked add, so the timers are always on.
+    Phases are timed on the poll threads as well as on the view.
+    """
+
+    FETCH = ['fetch %s' % c['command'] for c in COMMANDS] + ['decode']
+    FRAME = ['counters', 'historizer', 'sort', 'show_neighbors', 'write']
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = OrderedDict()
+
+    def add(self, phase, start):
+        """ Account the time since start, a monotonic() reading """
+        seconds = monotonic() - start
+        with self.lock:
+            stats = self.phases.get(phase)
+            if stats is None:
+                stats = self.phases[phase] = [0, 0.0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+            stats[3] = seconds
+
+    def report(self):
+        """ Count and ms per phase """
+        with self.lock:
+            return OrderedDict((phase, {'count': count,
+                                        'total_ms': 1000 * total,
+                                        'mean_ms': 1000 * total / count,
+                                        'max_ms': 1000 * top,
+                                        'last_ms': 1000 * last})
+                               for phase, (count, total, top, last)
+                               in self.phases.items())
+
+    def summary(self, phases):
+        """ Mean/max ms of some phases, for the debug pane """
+        report = self.report()
+        return "  ".join("%s %.2f/%.2f" % (phase, report[phase]['mean_ms'],
+                                           report[phase]['max_ms'])
+                         for phase in phases if phase in report) + \
+            " ms mean/max"
+
+    def dump(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+            f.write("\n")
+
+
+""" Phase timings of this process, see --timings """
+TIMINGS = Timings()
+
+
+class Sampler:
+
+    """
+    Samples the stacks of all threads every interval seconds, for
+    flame graphs. write() stores one 'thread;outer;...;inner count'
+    line per distinct stack, the collapsed format flamegraph.pl and
+    speedscope read.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            names = dict((thread.ident, thread.name)
+                         for thread in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == self._thread.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s (%s:%d)" % (
+                        code.co_name, path.basename(code.co_filename),
+                        code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread'))
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write("%s %d\n" % (stack, count))
+
+
+class NodeClient:
+
+    """
+    Long-lived HTTP client for a single IRI node.
+
+    Connections to the node are kept alive in a pool and reused
+    across polls, so steady-state polling does not pay for a new
+    TCP (and TLS) handshake on every call.
+    """
+
+    def __init__(self, node, headers=None, pool_size=POOL_SIZE,
+                 retries=RETRIES, connect_timeout=None, read_timeout=None):
+        self.node = node
+        self.headers = HEADERS if headers is None else headers
+        self.path = urlparse(node).path or '/'
+
+        urllib3 = load_urllib3()
+        timeout = urllib3.Timeout(
+            connect=URL_TIMEOUT if connect_timeout is None
+            else connect_timeout,
+            read=URL_TIMEOUT if read_timeout is None else read_timeout)
+
+        self.pool = urllib3.connection_from_url(
+            node,
+            maxsize=pool_size,
+            block=False,
+            timeout=timeout,
+            retries=urllib3.Retry(total=retries, redirect=False,
+                                  raise_on_status=False))
+        self.pool.ConnectionCls = self._counting(self.pool.ConnectionCls)
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+
+    def _counting(self, connection_cls):
+        """ Connection class that counts every socket actually opened """
+        client = self
+
+        class CountingConnection(connection_cls):
+            def connect(self):
+                with client.lock:
+                    client.connections_opened += 1
+                return connection_cls.connect(self)
+
+        return CountingConnection
+
+    @property
+    def connections_reused(self):
+        return self.requests - self.connections_opened
+
+    def fetch(self, data_to_send, method='POST', status_ok=200):
+        with self.lock:
+            self.requests += 1
+        start = monotonic()
+        try:
+            data = json.dumps(data_to_send)
+            response = self.pool.urlopen(method,
+                                         self.path,
+                                         body=data,
+                                         headers=self.headers)
+        except Exception as e:
+            return None, 'Unknown error: %s' % e
+        finally:
+            TIMINGS.add('fetch %s' % data_to_send.get('command'), start)
+
+        if response.status == status_ok:
+            start = monotonic()
+            try:
+                return json.loads(response.data.decode('utf-8')), None
+            finally:
+                TIMINGS.add('decode', start)
+        else:
+            raise Exception("Error response from node: code %d, "
+                            "response: '%s'" %
+                            (response.status, response.data))
+
+    def fetch_all(self, commands):
+        """
+        Send all commands to the node concurrently.
+        Returns the (data, error) results in command order and
+        the latency of each command in ms.
+        """
+        results = [None] * len(commands)
+        latencies = [0] * len(commands)
+
+        def worker(i):
+            start = time.time()
+            try:
+                results[i] = self.fetch(commands[i])
+            except Exception as e:
+                results[i] = e
+            latencies[i] = int(round((time.time() - start) * 1000))
+
+        threads = [threading.Thread(target=worker, args=(i,))
+                   for i in range(1, len(commands))]
+        for thread in threads:
+            thread.start()
+        if commands:
+            worker(0)
+        for thread in threads:
+            thread.join()
+
+        """ An error response fails its command, not the others """
+        results = [(None, result) if isinstance(result, Exception)
+                   else result for result in results]
+        return results, latencies
+
+    def close(self):
+        self.pool.close()
+
+
+""" Clients shared by fetch_data(), one per node URL """
+CLIENTS = {}
+
+
+def get_client(node):
+    if node not in CLIENTS:
+        CLIENTS[node] = NodeClient(node)
+    return CLIENTS[node]
+
+
 def fetch_data(data_to_send, method='POST', status_ok=200):
-    global NODE
-    global HEADERS
-    global URL_TIMEOUT
+    return get_client(NODE).fetch(data_to_send, method, status_ok)
+
+
+class Styles:
+
+    """
+    The terminal styles the views use, looked up once. Each style is a
+    function wrapping text the way calling the blessed formatting
+    string does, nested styles included, without resolving the
+    capability again for every cell of every frame.
+    """
+
+    NAMES = ['white', 'cyan', 'bright_cyan', 'green', 'yellow', 'red',
+             'bright_black', 'on_blue', 'black_on_cyan', 'black_on_green',
+             'black_on_red', 'black_on_white']
+
+    def __init__(self, term):
+        normal = u'%s' % term.normal
+        for name in self.NAMES:
+            setattr(self, name, self.style(u'%s' % getattr(term, name),
+                                           normal))
+
+    @staticmethod
+    def style(prefix, normal):
+        if not prefix:
+            return lambda text: text
+
+        def apply(text):
+            """ Styled text ended inside, e.g. a highlight, continues """
+            if normal in text:
+                text = text.replace(normal, normal + prefix)
+            return prefix + text + normal
+        return apply
+
+
+class Events:
+
+    """
+    Waits for what a view reacts to: a key, a new snapshot, a terminal
+    resize or a timer, so an idle view does not wake up. Snapshots
+    arrive on poller threads and resizes as SIGWINCH; both write to a
+    pipe, which the wait selects on together with the keyboard. The
+    wakeups are counted by cause, for --stats and the debug pane.
+
+    Without SIGWINCH, or off the main thread, the terminal size is
+    compared on every wakeup instead.
+    """
+
+    CAUSES = ['key', 'snapshot', 'resize', 'timer']
+
+    def __init__(self, term):
+        self.term = term
+        self.keyboard = getattr(term, '_keyboard_fd', None)
+        self.signal = (hasattr(signal, 'SIGWINCH') and
+                       isinstance(threading.current_thread(),
+                                  threading._MainThread))
+        self.resized = True
+        self.timers = []
+        self.sources = []
+        self.pipe = None
+        self.previous = None
+        self.lock = threading.Lock()
+        self.started = monotonic()
+        self.wakeups = OrderedDict((cause, 0) for cause in self.CAUSES)
+
+    def watching(self, sources):
+        """ Wake on the snapshots of these pollers, use with 'with' """
+        self.sources = list(sources)
+        return self
+
+    def __enter__(self):
+        self.pipe = pipe()
+        if fcntl is not None:
+            for fd in self.pipe:
+                fcntl.fcntl(fd, fcntl.F_SETFL,
+                            fcntl.fcntl(fd, fcntl.F_GETFL) | O_NONBLOCK)
+        self.resized = True
+        for source in self.sources:
+            source.subscribe(self.wake)
+        if self.signal:
+            self.previous = signal.signal(signal.SIGWINCH, self.handle)
+        return self
+
+    def __exit__(self, *exc):
+        if self.signal:
+            signal.signal(signal.SIGWINCH, self.previous)
+        for source in self.sources:
+            source.unsubscribe(self.wake)
+        with self.lock:
+            for fd in self.pipe:
+                close(fd)
+            self.pipe = None
+
+    def handle(self, signum, frame):
+        self.resized = True
+        self.notify(b'r')
+
+    def wake(self, snapshot=None):
+        """ Wake the view, from any thread """
+        with self.lock:
+            if self.pipe is not None:
+                self.notify(b's')
+
+    def notify(self, cause):
+        try:
+            write(self.pipe[1], cause)
+        except (OSError, TypeError):
+            pass  # a full pipe wakes the view all the same
+
+    def after(self, seconds):
+        """ Wake up within seconds, once """
+        self.timers.append(monotonic() + seconds)
+
+    def wait(self):
+        """ Sleep until something happens, return the key pressed if any """
+        key = self.term.inkey(timeout=0)
+        if key:
+            self.wakeups['key'] += 1
+            return key
+
+        timeout = None
+        if self.timers:
+            timeout = max(0, min(self.timers) - monotonic())
+            self.timers = []
+        fds = [self.pipe[0]]
+        if self.keyboard is not None:
+            fds.append(self.keyboard)
+        try:
+            ready = select.select(fds, [], [], timeout)[0]
+        except (select.error, OSError, IOError):
+            ready = []  # interrupted by a signal
+
+        if self.pipe[0] in ready:
+            causes = self.drain()
+            for cause, name in ((b'r', 'resize'), (b's', 'snapshot')):
+                if cause in causes:
+                    self.wakeups[name] += 1
+        elif self.keyboard is not None and self.keyboard in ready:
+            self.wakeups['key'] += 1
+        else:
+            self.wakeups['timer'] += 1
+        return self.term.inkey(timeout=0)
 
-    http = urllib3.PoolManager()
+    def drain(self):
+        causes = b''
+        try:
+            while True:
+                data = read(self.pipe[0], 512)
+                if not data:
+                    break
+                causes += data
+        except (OSError, IOError):
+            pass
+        return causes
+
+    def changed(self, size):
+        """ True once after each resize, size is (height, width) shown """
+        if not self.signal:
+            return (self.term.height, self.term.width) != size
+        resized, self.resized = self.resized, False
+        return resized
+
+    def stats(self):
+        """ Wakeups per second, in total and by cause """
+        seconds = max(monotonic() - self.started, 1e-3)
+        total = sum(self.wakeups.values())
+        return "%d wakeups in %.1f s, %.2f/s (%s)" % (
+            total, seconds, total / seconds,
+            ", ".join("%s %d" % item for item in self.wakeups.items()))
+
+
+class Layout:
+
+    """
+    Geometry of the IriTop screen for one terminal size: where the
+    node info and neighbor columns start, their widths and the padded
+    footer. Computed when the size changes, so drawing a frame does no
+    geometry math. The neighbor table header row is kept per sort and
+    scroll state, as it only changes with those.
+    """
+
+    COLUMNS = 9
+    LABEL_WIDTH = 18
+
+    def __init__(self, height, width, footer):
+        self.height, self.width = height, width
+        self.size = (height, width)
+
+        """ Node info: label and value position per column """
+        third = width // 3
+        self.info = [(third * col, third * col + self.LABEL_WIDTH)
+                     for col in range(3)]
+
+        """ Histogram bar width per number of columns spanned """
+        self.bars = [None] + [third - self.LABEL_WIDTH - 2 + span * third
+                              for span in range(3)]
+
+        """ Neighbors: first column takes the remainder of the width """
+        self.column_width = width // self.COLUMNS
+        first = width - (self.COLUMNS - 1) * self.column_width
+        self.column_starts = [0] + [first + c * self.column_width
+                                    for c in range(self.COLUMNS - 1)]
+        self.address_width = 3 * (self.column_width + 1)
+
+        self.footer = footer.ljust(width)[:width]
+        self.headers = {}
+
+
+class Screen:
+
+    """
+    Model of what is shown on the terminal.
+
+    A frame is drawn as text segments placed with put(). flush()
+    compares the frame with the one currently on the terminal and
+    emits only the segments that changed, in a single buffered write.
+    Rows on which a segment shrinks or disappears are blanked and
+    redrawn as a whole, so no stale characters are left behind.
+
+    Where the terminal supports it the write is wrapped in a
+    synchronized update, so a frame is never shown half drawn.
+    """
+
+    def __init__(self, term):
+        self.term = term
+        self.frame = {}
+        self.shown = {}
+        self.pending = []
+        self.moves = {}
+        self.sync = (term.does_styling and
+                     not (term.kind or 'dumb').startswith(NO_SYNC_TERMS))
+
+        """ Output of the last frame and totals """
+        self.frame_bytes = 0
+        self.frame_writes = 0
+        self.frames = 0
+        self.bytes = 0
+        self.writes = 0
+
+    def put(self, row, col, text):
+        self.frame.setdefault(row, {})[col] = text
+
+    def clear(self):
+        """ Clear the terminal and forget what was shown, e.g. on resize """
+        self.shown = {}
+        self.moves = {}
+        self.pending.append(self.term.clear)
+
+    def move(self, row, col):
+        """ Cursor movement to a position, cached until the next clear """
+        try:
+            return self.moves[row, col]
+        except KeyError:
+            move = self.moves[row, col] = u'%s' % self.term.move(row, col)
+            return move
+
+    def message(self, text):
+        """ Show a one line message right away, outside of a frame """
+        self.pending.append(self.move(0, 0) + text)
+        self.write(self.pending)
+        self.pending = []
+
+    def flush(self):
+        out = self.pending
+        length = self.term.length
+
+        for row in sorted(set(self.shown) | set(self.frame)):
+            old = self.shown.get(row, {})
+            new = self.frame.get(row, {})
+            if old == new:
+                continue
 
-    try:
-        data = json.dumps(data_to_send)
-        response = http.request(method,
-                                NODE,
-                                body=data,
-                                timeout=URL_TIMEOUT,
-                                headers=HEADERS)
-    except Exception as e:
-        return None, 'Unknown error: %s' % e
+            changed = [col for col in new if old.get(col) != new[col]]
+            if (any(col not in new for col in old) or
+                    any(col in old and length(new[col]) != length(old[col])
+                        for col in changed)):
+                """ Blank the old row, then redraw it completely """
+                for col, text in old.items():
+                    out.append(self.move(row, col) + " " * length(text))
+                changed = new.keys()
+
+            """ Segments overlapped by a redrawn one are redrawn as well """
+            end = -1
+            for col in sorted(new):
+                if col in changed or col < end:
+                    out.append(self.move(row, col) + new[col])
+                    end = max(end, col + length(new[col]))
+
+        self.shown = self.frame
+        self.frame = {}
+        self.pending = []
+
+        self.frames += 1
+        self.frame_bytes, self.frame_writes = 0, 0
+        if out:
+            self.write(out)
+
+    def write(self, out):
+        start = monotonic()
+        if self.sync:
+            out = [SYNC_BEGIN] + out + [SYNC_END]
+        data = "".join(out)
+        self.term.stream.write(data)
+        self.term.stream.flush()
+        TIMINGS.add('write', start)
+
+        self.frame_bytes = len(data.encode('utf-8'))
+        self.frame_writes = 1
+        self.bytes += self.frame_bytes
+        self.writes += 1
+
+
+class NeighborTable:
+
+    """
+    Tx counters of all neighbors, kept in columns.
+
+    Every neighbor address is interned to a slot once. Per counter
+    the table keeps integer arrays indexed by slot with the current
+    and previous polled value, the baseline, the delta between the
+    last two polls and the value last drawn on screen (-1 if never
+    drawn), so a poll or a frame does not allocate per-neighbor keys.
+
+    Rates are tx/s over the monotonic time between two polls, so they
+    do not depend on how long a poll took. Each rate also feeds an
+    exponentially weighted average per window, decayed by the time
+    that passed like the load average is, which takes O(1) state.
+
+    Neighbors absent for more than ttl polls are evicted and their
+    slot is reused. At most max_tracked neighbors are kept; when full,
+    the neighbor seen longest ago makes room for a new one.
+    """
+
+    WINDOWS = [('1m', 60), ('5m', 300), ('15m', 900)]
+
+    def __init__(self, counters, ttl=NEIGHBOR_TTL,
+                 max_tracked=MAX_TRACKED_NEIGHBORS):
+        self.counters = counters
+        self.index = dict((key, c) for c, key in enumerate(counters))
+        self.ttl = ttl
+        self.max_tracked = max_tracked
+        self.slots = {}
+        self.addresses = []
+        self.connection_types = []
+        self.free = []
+        self.rows = []
+        self.polls = 0
+        self.evicted = 0
+        self.untracked = 0
+        self.clock = None
+
+        """ Poll in which each slot was last seen, rates averaged """
+        self.seen = array(INT_TYPECODE)
+        self.rated = array(INT_TYPECODE)
+
+        self.current = [array(INT_TYPECODE) for _ in counters]
+        self.previous = [array(INT_TYPECODE) for _ in counters]
+        self.baseline = [array(INT_TYPECODE) for _ in counters]
+        self.delta = [array(INT_TYPECODE) for _ in counters]
+        self.drawn = [array(INT_TYPECODE) for _ in counters]
+        self.rate = [array('d') for _ in counters]
+        self.average = OrderedDict((name, [array('d') for _ in counters])
+                                   for name, _ in self.WINDOWS)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def slot(self, address):
+        """
+        Slot of a neighbor address, allocated on first sight.
+        Returns None if the table is full of neighbors in this poll.
+        """
+        slot = self.slots.get(address)
+        if slot is not None:
+            return slot
+
+        if len(self.slots) >= self.max_tracked:
+            oldest = min(self.slots.values(), key=self.seen.__getitem__)
+            if self.seen[oldest] == self.polls:
+                return None
+            self.evict(oldest)
+
+        if self.free:
+            slot = self.free.pop()
+            self.addresses[slot] = address
+        else:
+            slot = len(self.addresses)
+            self.addresses.append(address)
+            self.connection_types.append('')
+            self.seen.append(0)
+            self.rated.append(0)
+            for column in self.columns():
+                column.append(0)
+
+        self.slots[address] = slot
+        self.seen[slot] = 0
+        self.rated[slot] = 0
+        for column in self.columns():
+            column[slot] = 0
+        for c in range(len(self.counters)):
+            self.drawn[c][slot] = -1
+        return slot
+
+    def columns(self):
+        columns = (self.current + self.previous + self.baseline +
+                   self.delta + self.drawn + self.rate)
+        for average in self.average.values():
+            columns += average
+        return columns
+
+    def evict(self, slot):
+        del self.slots[self.addresses[slot]]
+        self.addresses[slot] = None
+        self.connection_types[slot] = ''
+        self.free.append(slot)
+        self.evicted += 1
+
+    def update(self, neighbors, now=None):
+        """
+        Store the counters of a poll, rows follow the poll order.
+        now is the monotonic time the counters were polled at; a poll
+        that did not refresh the neighbors repeats it and is ignored.
+        """
+        now = monotonic() if now is None else now
+        if now == self.clock:
+            return
+
+        elapsed = now - self.clock if self.clock is not None else 0
+        self.clock = now
+        decay = [(self.average[name], 1 - math.exp(-elapsed / window))
+                 for name, window in self.WINDOWS]
+
+        self.polls += 1
+        self.untracked = 0
+        rows = []
+        start = monotonic()
+        for neighbor in neighbors:
+            slot = self.slot(neighbor['address'])
+            if slot is None:
+                self.untracked += 1
+                continue
+            self.connection_types[slot] = neighbor['connectionType']
+
+            # Deltas only count from a neighbor seen in the last poll
+            known = self.seen[slot] == self.polls - 1
+            self.seen[slot] = self.polls
+
+            for c, key in enumerate(self.counters):
+                value = neighbor.get(key, 0)
+                prev = self.current[c][slot] if known else 0
+                self.previous[c][slot] = prev
+                self.current[c][slot] = value
+                self.delta[c][slot] = value - prev if prev > 0 else 0
+
+            # A rate needs two polls in a row of this neighbor
+            if known and elapsed > 0:
+                self.rate_slot(slot, elapsed, decay)
+            else:
+                self.rated[slot] = 0
+                for c in range(len(self.counters)):
+                    self.rate[c][slot] = 0
+            rows.append(slot)
+        self.rows = rows
+        TIMINGS.add('counters', start)
+
+        # Forget neighbors that went away
+        expired = self.polls - self.ttl
+        for slot in [slot for slot in self.slots.values()
+                     if self.seen[slot] < expired]:
+            self.evict(slot)
+
+    def rate_slot(self, slot, elapsed, decay):
+        """ Rate of each counter of a slot, added to its averages """
+        first = self.rated[slot] == 0
+        self.rated[slot] += 1
+        for c in range(len(self.counters)):
+            rate = max(0, self.delta[c][slot]) / elapsed
+            self.rate[c][slot] = rate
+            for average, alpha in decay:
+                if first:
+                    average[c][slot] = rate
+                else:
+                    average[c][slot] += alpha * (rate - average[c][slot])
+
+    def values(self, c, mode=None):
+        """ Column of counter c: current values, rates or an average """
+        if mode is None:
+            return self.current[c]
+        if mode == 'rate':
+            return self.rate[c]
+        return self.average[mode][c]
+
+    def set_baseline(self):
+        """ Baseline of each counter is its current value """
+        for slot in self.rows:
+            for c in range(len(self.counters)):
+                self.baseline[c][slot] = self.current[c][slot]
+
+    def sorted_rows(self, column, reverse, mode=None):
+        """ Rows ordered by address or by the values of a counter """
+        if column in self.index:
+            values = self.values(self.index[column], mode)
+            return sorted(self.rows, key=values.__getitem__, reverse=reverse)
+        return sorted(self.rows, key=self.addresses.__getitem__,
+                      reverse=reverse)
+
+
+class LatencyWindow:
+
+    """
+    Response times over a sliding time window.
+
+    Samples are kept in a queue together with a running sum, a
+    histogram of log-spaced buckets from which the quantiles are
+    estimated and a monotonic queue for the maximum. Samples expire by
+    their time, so the window spans its seconds however often samples
+    arrive. An optional capacity bounds the queue. Adding a sample and
+    expiring old ones are O(1).
+    """
+
+    """ Bucket bounds grow by 10%, so quantiles are within 10% """
+    GROWTH = 1.1
+    BUCKETS = 128
+
+    def __init__(self, window, capacity=None):
+        self.window = window
+        self.capacity = capacity
+        self.samples = deque()
+        self.maxima = deque()
+        self.counts = [0] * self.BUCKETS
+        self.total = 0
+        self.seq = 0
+
+    @classmethod
+    def bucket(cls, value):
+        return min(cls.BUCKETS - 1,
+                   int(math.log(value + 1) / math.log(cls.GROWTH)))
+
+    @classmethod
+    def bucket_value(cls, bucket):
+        return int(cls.GROWTH ** (bucket + 1)) - 1
+
+    def add(self, value, now):
+        self.seq += 1
+        if self.capacity is not None and len(self.samples) == self.capacity:
+            self._expire_oldest()
+        bucket = self.bucket(value)
+        self.samples.append((now, value, bucket, self.seq))
+        self.counts[bucket] += 1
+        self.total += value
+
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((self.seq, value))
+
+        cutoff = now - self.window
+        while self.samples[0][0] < cutoff:
+            self._expire_oldest()
+
+    def _expire_oldest(self):
+        _, value, bucket, seq = self.samples.popleft()
+        self.counts[bucket] -= 1
+        self.total -= value
+        while self.maxima and self.maxima[0][0] <= seq:
+            self.maxima.popleft()
+
+    def quantiles(self, qs):
+        """ Estimated value of each (ascending) quantile in qs """
+        result = []
+        n = len(self.samples)
+        seen = 0
+        i = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            while i < len(qs) and seen >= qs[i] * n and seen > 0:
+                result.append(self.bucket_value(bucket))
+                i += 1
+        return result + [0] * (len(qs) - len(result))
+
+    def summary(self):
+        n = len(self.samples)
+        top = self.maxima[0][1] if self.maxima else 0
+
+        # Bucket bounds may overshoot, the maximum is exact
+        p50, p95, p99 = [min(q, top) for q in
+                         self.quantiles([0.5, 0.95, 0.99])]
+        return {'count': n,
+                'mean': self.total // n if n else 0,
+                'p50': p50,
+                'p95': p95,
+                'p99': p99,
+                'max': top}
+
+
+class RollingStats:
+
+    """ Response time statistics over the last 1, 5 and 15 minutes """
+
+    WINDOWS = [('1m', 60), ('5m', 300), ('15m', 900)]
+
+    def __init__(self):
+        self.last = 0
+
+        """ Sized by time, --interval and replays set the sample rate """
+        self.windows = OrderedDict(
+            (name, LatencyWindow(seconds)) for name, seconds in self.WINDOWS)
+        self.summaries = dict((name, window.summary())
+                              for name, window in self.windows.items())
+
+    def add(self, value, now=None):
+        now = time.time() if now is None else now
+        self.last = value
+        for name, window in self.windows.items():
+            window.add(value, now)
+            self.summaries[name] = window.summary()
+
+
+""" Immutable result of one poll of the node """
+Snapshot = namedtuple('Snapshot', ['seq', 'url', 'time', 'clock', 'node',
+                                   'neighbors', 'duration', 'latencies',
+                                   'error'])
+
+
+class Poller:
+
+    """
+    Polls the node on a background thread and publishes each result
+    as an immutable Snapshot, so a slow node never blocks keyboard
+    input or redraws.
+
+    Every command has its own interval, poll_delay unless intervals
+    names another. A command that fails or answers slowly backs off
+    exponentially, with jitter, and speeds back up as the node
+    recovers, so the load on the node follows its health. A snapshot
+    holds the latest answer to every command; latencies are None for
+    the commands not polled this time.
+
+    A poll fails when none of its commands answer. Its snapshot keeps
+    the last good answers, next to the error; a single command failing
+    only backs off. After BREAKER_FAILURES failed polls in a row the
+    circuit opens: a single command probes the node, as slowly as its
+    backoff says, and the others wait until it answers again.
+    """
+
+    def __init__(self, client, commands, poll_delay, intervals=None):
+        self.client = client
+        self.commands = commands
+        self.poll_delay = poll_delay
+        self.intervals = [(intervals or {}).get(c['command'], poll_delay)
+                          for c in commands]
+        self.backoff = list(self.intervals)
+        self.due = [time.time()] * len(commands)
+        self.random = random.Random()
+        self.seq = 0
+        self.snapshot = None
+        self.node = None
+        self.neighbors = ()
+        self.clock = None
+        self.failures = 0
+        self.errors = 0
+        self.last_error = None
+        self.listeners = []
+        self.fetching = False
+        self.next_poll = time.time()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
 
-    if response.status == status_ok:
-        return json.loads(response.data.decode('utf-8')), None
-    else:
-        raise Exception("Error response from node: code %d, response: '%s'" %
-                        (response.status, response.data))
+    @property
+    def tripped(self):
+        """ True while the circuit breaker holds back the node's polls """
+        return self.failures >= BREAKER_FAILURES
+
+    def due_commands(self, now):
+        """ Numbers of the commands due for polling at now """
+        due = [i for i, due in enumerate(self.due) if due <= now]
+        return due[:1] if self.tripped else due
+
+    def poll(self, due=None):
+        """ Poll the due commands, all of them if due is None """
+        due = range(len(self.commands)) if due is None else due
+        latencies = [None] * len(self.commands)
+        error = None
+        failed = True
+
+        self.fetching = True
+        start, ticks = time.time(), monotonic()
+        try:
+            results, fetched = self.client.fetch_all(
+                [self.commands[i] for i in due])
+        except Exception as e:
+            results, fetched = [(None, e)] * len(due), [0] * len(due)
+        end = time.time()
+        self.fetching = False
+
+        for i, (data, e), latency in zip(due, results, fetched):
+            latencies[i] = latency
+            self.schedule(i, start, latency, e is not None)
+            if e is not None:
+                error = self.last_error = e
+                continue
+            failed = False
+            if 'appName' in data.keys():
+                self.node = data
+            elif 'neighbors' in data.keys():
+                self.neighbors = tuple(data['neighbors'])
+
+                # The node sampled its counters somewhere during the fetch
+                self.clock = (ticks + monotonic()) / 2
+
+        if failed:
+            self.failures += 1
+            self.errors += 1
+        elif self.tripped:
+            """ The node is back, poll everything it missed """
+            self.failures = 0
+            self.due = [d if i in due else end
+                        for i, d in enumerate(self.due)]
+        else:
+            self.failures = 0
+        if self.tripped:
+            """ Hold the other commands back until the next probe """
+            probe = max(self.due[i] for i in due)
+            self.due = [max(d, probe) for d in self.due]
+
+        self.seq += 1
+        self.next_poll = min(self.due)
+        self.snapshot = Snapshot(seq=self.seq,
+                                 url=self.client.node,
+                                 time=end,
+                                 clock=self.clock,
+                                 node=self.node,
+                                 neighbors=self.neighbors,
+                                 duration=int(round((end - start) * 1000)),
+                                 latencies=tuple(latencies),
+                                 error=error if failed else None)
+        for listener in self.listeners:
+            try:
+                listener(self.snapshot)
+            except Exception as e:
+                report_error("snapshot listener", e)
+        return self.snapshot
+
+    def schedule(self, i, start, latency, failed):
+        """ Next poll of command i, backing off while it is unhealthy """
+        base = self.intervals[i]
+        if failed or latency > SLOW_LATENCY:
+            self.backoff[i] = min(self.backoff[i] * 2, max(base, BACKOFF_MAX))
+        else:
+            self.backoff[i] = max(base, self.backoff[i] / 2)
+
+        interval = self.backoff[i]
+        if interval > base:
+            interval *= self.random.uniform(1 - BACKOFF_JITTER,
+                                            1 + BACKOFF_JITTER)
+        self.due[i] = start + interval
+
+    def subscribe(self, listener):
+        """ Call listener with every new snapshot, on the poll thread """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    def now(self):
+        """ Clock the snapshot times compare to """
+        return time.time()
+
+    def _run(self):
+        while not self._stop.is_set():
+            due = self.due_commands(time.time())
+            if due:
+                self.poll(due)
+            self._stop.wait(max(0, min(self.due) - time.time()))
+
+
+class WorkerPool:
+
+    """ Fixed set of daemon threads running submitted jobs """
+
+    def __init__(self, size):
+        self.jobs = queue.Queue()
+        self.threads = [threading.Thread(target=self._work)
+                        for _ in range(max(1, size))]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, func, *args):
+        self.jobs.put((func, args))
+
+    def stop(self):
+        for _ in self.threads:
+            self.jobs.put((None, None))
+
+    def _work(self):
+        while True:
+            func, args = self.jobs.get()
+            if func is None:
+                break
+            try:
+                func(*args)
+            except Exception as e:
+                report_error("worker", e)
+
+
+class FleetPoller:
+
+    """
+    Polls many nodes concurrently on a pool of worker threads at a
+    fixed cadence. A node whose previous poll is still in flight is
+    skipped for that tick, so one slow node never delays the others.
+    Each node keeps its own Poller holding the latest Snapshot and
+    deciding which of its commands are due.
+    """
+
+    def __init__(self, clients, commands, poll_delay, workers=WORKERS,
+                 intervals=None):
+        self.pollers = OrderedDict((client.node,
+                                    Poller(client, commands, poll_delay,
+                                           intervals))
+                                   for client in clients)
+        self.poll_delay = min([poll_delay] + list(
+            (intervals or {}).values()))
+        self.workers = workers
+        self.ticks = 0
+        self.skipped = 0
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self.pool = WorkerPool(self.workers)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.pool.stop()
+
+    def alive(self):
+        """ False once the tick thread or a worker has died """
+        return (self._thread.is_alive() and
+                all(thread.is_alive() for thread in self.pool.threads))
+
+    def _poll(self, node, poller, due):
+        try:
+            poller.poll(due)
+        finally:
+            with self._lock:
+                self._in_flight.discard(node)
+
+    def _run(self):
+        next_tick = time.time()
+        while not self._stop.is_set():
+            self.ticks += 1
+            next_tick += self.poll_delay
+            now = time.time()
+            for node, poller in self.pollers.items():
+                due = poller.due_commands(now)
+                if not due:
+                    continue
+                with self._lock:
+                    if node in self._in_flight:
+                        self.skipped += 1
+                        continue
+                    self._in_flight.add(node)
+                self.pool.submit(self._poll, node, poller, due)
+
+            # Never try to catch up on missed ticks
+            next_tick = max(next_tick, time.time())
+            self._stop.wait(max(0, next_tick - time.time()))
+
+
+def set_auth_header(args):
+    """ Set authentication header if required """
+    if args.username is not None:
+        auth_str = '%s:%s' % (args.username, args.password)
+        auth_token = base64.b64encode(auth_str.encode("utf-8"))
+        HEADERS['Authorization'] = 'Basic %s' % auth_token.decode()
+
+
+def node_client(node, args):
+    return NodeClient(node,
+                      pool_size=args.pool_size,
+                      retries=args.retries,
+                      connect_timeout=args.connect_timeout,
+                      read_timeout=args.read_timeout)
 
 
 class IriTop:
 
     global HEADERES
 
-    def __init__(self, args):
+    def __init__(self, args, node=None, term=None, client=None,
+                 quit_hint="Q to exit", poller=None):
 
         """
         This instantiates the Terminal class from blessed.
@@ -274,15 +1781,21 @@ class IriTop:
         found via 'find /usr/share/terminfo -type f -printf "%f\n"'
         As an example setting to vt200 ensures no color output.
         """
-        self.term = Terminal()
-
+        self.term = terminal() if term is None else term
+        self.screen = Screen(self.term)
+        self.styles = Styles(self.term)
+        self.events = Events(self.term)
+
+        self.node = NODE if node is None else node
+        self.quit_hint = quit_hint
+        self.poller = poller
         self.prev = {}
+        self.args = args
         self.poll_delay = args.poll_delay
         self.blink_delay = args.blink_delay
 
         """ The commands sent in the query to the node """
-        self.commands = [{'command': 'getNeighbors'},
-                         {'command': 'getNodeInfo'}]
+        self.commands = COMMANDS
 
         self.txkeys = [{'keyshort': 'ad', 'sortkey': '1',
                         'header': 'Neighbor Address',
@@ -313,19 +1826,34 @@ class IriTop:
                         'key': 'numberOfStaleTransactions', 'col': 8,
                         'sortcolumn': 'numberOfStaleTransactions'}]
         self.randSeed = random.randint(0, 100000)
-        self.baseline = dict()
+        self.table = NeighborTable([k['key'] for k in self.txkeys[1:]],
+                                   ttl=args.neighbor_ttl,
+                                   max_tracked=args.max_tracked_neighbors)
+        self.all_tx = self.table.index['numberOfAllTransactions']
+        self.invalid_tx = self.table.index['numberOfInvalidTransactions']
         self.baselineStr = ['Off', 'On']
         self.baselineToggle = 0
         self.obscureAddrToggle = args.obscure_address
+        self.debugToggle = 0
+        self.scroll = 0
+        self.page_size = 1
         self.width = 0
         self.height = 0
-        self.oldheight = 0
-        self.oldwidth = 0
+        self.layout = None
+        self.highlighted = False
         self.incommunicados = 0
         self.localhost = self.set_local_node()
-        self.duration_hist = list()
-        self.duration = 0
-        self.duration_avg = 0
+        self.latencies = [0] * len(self.commands)
+        self.latency = RollingStats()
+
+        """ Time of the last good poll, older data is shown as stale """
+        self.good_time = None
+        self.latency_window = 0
+
+        """ Counters shown as totals, tx/s or a tx/s average """
+        self.rate_modes = ([None, 'rate'] +
+                           [name for name, _ in NeighborTable.WINDOWS])
+        self.rate_mode = 0
         self.sortmode = False
         self.sortcolumn = None
         self.sortorderlist = ["", " "+u"\u25BC", " "+u"\u25B2"]
@@ -340,44 +1868,51 @@ class IriTop:
                     self.sortorder = self.sortorderlist[1]
                 else:
                     self.sortorder = self.sortorderlist[2]
-                args.sort = abs(args.sort)
-                self.sortcolumn = self.txkeys[args.sort-1]['sortcolumn']
+                self.sortcolumn = self.txkeys[abs(args.sort)-1]['sortcolumn']
             except IndexError:
                 self.sortcolumn = self.txkeys[0]['sortcolumn']
 
-        # Set authentication header if required
-        if args.username is not None:
-            auth_str = '%s:%s' % (args.username, args.password)
-            auth_token = base64.b64encode(auth_str.encode("utf-8"))
-            HEADERS['Authorization'] = 'Basic %s' % auth_token.decode()
-
-    @property
-    def get_local_ips(self):
-        return check_output(['/bin/hostname', '--all-ip-addresses']
-                            ).rstrip().split()
+        """ A replay has no node to connect to """
+        set_auth_header(args)
+        if client is None and poller is None:
+            client = node_client(self.node, args)
+        self.client = client
 
     def set_local_node(self):
-        local_ips = ['localhost', '127.0.0.1', '::1']
-        local_ips.extend(self.get_local_ips)
-        if urlparse(NODE.lower()).hostname in local_ips:
-            return True
-        return False
+        return is_local(urlparse(self.node.lower()).hostname)
 
     def run(self, stdscr):
 
         """ Clear the screen on start """
         stdscr.clear()
 
+        self.screen.message("IRITop connecting to node %s..." %
+                            self.showAddress(self.node))
+
+        """ Poll the node in the background, unless replaying """
+        sinks = []
+        if self.poller is None:
+            self.poller = Poller(self.client, self.commands, self.poll_delay,
+                                 self.args.intervals)
+            sinks = start_sinks(self.args, [self.poller])
+        self.poller.start()
+        try:
+            self.loop()
+        finally:
+            self.poller.stop()
+            for sink in sinks:
+                sink.stop()
+
+    def loop(self):
+
         """ Counter for number of cycles """
         cycles = 0
         node = None
 
-        print("IRITop connecting to node %s..." % self.showAddress(NODE))
-
-        with self.term.hidden_cursor():
+        events = self.events.watching([self.poller])
+        with self.term.hidden_cursor(), events:
             val = ""
-            tlast = 0
-            self.hist = {}
+            seq = 0
             while val.lower() != 'q':
 
                 """ Exit if max cycles specified """
@@ -386,7 +1921,15 @@ class IriTop:
 
                 random.seed(self.randSeed)
 
-                val = self.term.inkey(timeout=self.blink_delay)
+                """ Sleep until a key, snapshot, resize or timer """
+                events.after(self.timeout())
+                if self.highlighted:
+                    """ Changed values are highlighted until then """
+                    events.after(self.blink_delay)
+                    self.highlighted = False
+                val = events.wait()
+                if self.layout is None or events.changed(self.layout.size):
+                    self.relayout()
 
                 # Sort mode detection
                 if val.lower() == 's':
@@ -416,95 +1959,112 @@ class IriTop:
                                 self.sortcolumn = k['sortcolumn']
                                 self.sortmode = False
 
-                self.oldheight, self.oldwidth = self.height, self.width
-                self.height, self.width = self.term.height, self.term.width
-
-                time_past = int(time.time()) - tlast
-                time_remain = self.poll_delay - time_past
-                if time_past > self.poll_delay:
+                """ Process the latest snapshot published by the poller """
+                snapshot = self.poller.snapshot
+                if snapshot is not None and snapshot.seq != seq:
+                    seq = snapshot.seq
+                    if snapshot.error is None or self.good_time is None:
+                        self.good_time = snapshot.time
 
                     if node:
                         self.prev_ms_start = node["milestoneStartIndex"]
 
-                    """ Query data from node, save duration """
-                    startTime = int(round(time.time() * 1000))
-                    results = [fetch_data(self.commands[i]) for i
-                               in range(len(self.commands))]
-                    endTime = int(round(time.time() * 1000))
-                    self.logDuration(endTime - startTime)
+                    self.latencies = [old if new is None else new
+                                      for old, new in
+                                      zip(self.latencies, snapshot.latencies)]
+                    self.logDuration(snapshot.duration, snapshot.time)
 
                     """ Increase iteration cycle """
                     cycles += 1
 
-                    """ Process response data """
-                    neighbors = None
-                    node = None
-                    for data, e in results:
-                        if e is not None:
-                            raise Exception("Error fetching data from node:"
-                                            " %s\n" % e)
-                        if 'appName' in data.keys():
-                            node = data
-                        elif 'neighbors' in data.keys():
-                            neighbors = data['neighbors']
-
-                    tlast = int(time.time())
-
-                    for neighbor in neighbors:
-                        for txkey in self.txkeys[1:]:
-                            if txkey['key'] not in neighbor:
-                                neighbor[txkey['key']] = 0
-                                neighbor[txkey['keyshort']] = 0
-                                neighbor['%sDelta' % txkey['key']] = 0
+                    node = snapshot.node or node
 
                     # Keep history of tx
-                    tx_history = {}
-                    for neighbor in neighbors:
-                        for txkey in self.txkeys[1:]:
-                            self.historizer(txkey['keyshort'],
-                                            txkey['key'],
-                                            tx_history,
-                                            neighbor)
-                    self.hist = tx_history
+                    self.historizer(snapshot.neighbors, snapshot.clock)
+
+                """ A bounded run ends with the replay it shows """
+                replaying = isinstance(self.poller, Replayer)
+                if (replaying and int(MAX_CYCLES) != 0 and
+                        self.poller.finished and
+                        seq == getattr(self.poller.snapshot, 'seq', 0)):
+                    break
+
+                """ Nothing to show until the first poll completes """
+                poller = self.poller
+                if node is None:
+                    if poller.failures:
+                        self.screen.message(
+                            "IRITop connecting to node %s... %d failed"
+                            " polls: %s" % (self.showAddress(self.node),
+                                            poller.failures,
+                                            poller.last_error))
+                    continue
 
                 if val.lower() == 'o':
                     self.obscureAddrToggle = self.obscureAddrToggle ^ 1
 
-                if val.lower() == 'b':
-                    for neighbor in neighbors:
-                        for txkey in self.txkeys[1:]:
-                            self.baseline[self.getBaselineKey(neighbor,
-                                          txkey['keyshort'])] = \
-                                          neighbor[txkey['key']]
-                    self.baselineToggle = self.baselineToggle ^ 1
+                if val.lower() == 'd':
+                    self.debugToggle = self.debugToggle ^ 1
+
+                if val.lower() == 'w':
+                    self.latency_window = ((self.latency_window + 1) %
+                                           len(RollingStats.WINDOWS))
 
-                if ((self.oldheight != self.height) or
-                        (self.oldwidth != self.width)):
-                    print(self.term.clear)
+                if val.lower() == 'r':
+                    self.rate_mode = ((self.rate_mode + 1) %
+                                      len(self.rate_modes))
 
-                print(self.term.move(0, 0) + self.term.black_on_cyan(
-                      "IRITop - Simple IOTA IRI Node Monitor (%s)"
-                      .ljust(self.width) % __VERSION__))
-                s = str(time_remain) if time_remain > 0 else 'fetch'
-                print(self.term.move(0, self.width-6) +
-                      self.term.black_on_cyan(s.rjust(6)))
+                # Scroll the neighbor table, show_neighbors() clamps it
+                if val.code == self.term.KEY_PGUP:
+                    self.scroll -= self.page_size
+                elif val.code == self.term.KEY_PGDOWN:
+                    self.scroll += self.page_size
+                elif val.code == self.term.KEY_HOME:
+                    self.scroll = 0
+                elif val.code == self.term.KEY_END:
+                    self.scroll = sys.maxsize
+
+                if val.lower() == 'b':
+                    self.table.set_baseline()
+                    self.baselineToggle = self.baselineToggle ^ 1
 
-                for neighbor in neighbors:
-                    for txkey in self.txkeys[1:]:
-                        key = self.getBaselineKey(neighbor, txkey['keyshort'])
-                        if key not in self.baseline:
-                            self.baseline[key] = 0
+                if replaying and val in ('<', '>'):
+                    step = REPLAY_STEP if val == '>' else -REPLAY_STEP
+                    self.poller.seek(time=self.poller.now() + step)
+
+                title = "IRITop - Simple IOTA IRI Node Monitor (%s)" % \
+                    __VERSION__
+                style = self.styles.black_on_cyan
+                if poller.failures:
+                    title += " - node not responding, %d failed polls: %s" % \
+                        (poller.failures, poller.last_error)
+                    style = self.styles.black_on_red
+                self.screen.put(0, 0, style(title[:self.width]
+                                            .ljust(self.width)))
+                now = self.poller.now()
+                """ The time of the next poll needs no redraw to count down """
+                s = "next %s" % time.strftime(
+                    '%H:%M:%S', time.localtime(self.poller.next_poll))
+                if self.poller.fetching or self.poller.next_poll <= now:
+                    s = 'fetch'
+                elif poller.tripped:
+                    s = "retry " + s[5:]
+                if replaying:
+                    s = "Replay %s x%g" % (time.strftime(
+                        '%Y-%m-%d %H:%M:%S', time.localtime(now)),
+                        self.poller.speed)
+                self.screen.put(0, self.width - len(s), style(s.rjust(6)))
 
                 self.show(1, 0, "App Name", node, "appName")
                 self.show(2, 0, "App Version", node, "appVersion")
 
-                s = self.term.cyan("Free: ") + \
+                s = self.styles.cyan("Free: ") + \
                     str(node["jreFreeMemory"]//MB) + \
                     " Mb  " + \
-                    self.term.cyan("Max: ") + \
+                    self.styles.cyan("Max: ") + \
                     str(node["jreMaxMemory"]//MB) + \
                     " Mb " + \
-                    self.term.cyan("Total: ") + \
+                    self.styles.cyan("Total: ") + \
                     str(node["jreTotalMemory"]//MB) + " Mb   "
                 self.show_string(1, 1, "JRE Memory", s)
 
@@ -535,72 +2095,111 @@ class IriTop:
                 self.show(3, 1, "Tx To Request", node,
                           "transactionsToRequest")
 
-                self.show_string(6, 0, "Node Address", self.showAddress(NODE))
+                self.show_string(6, 0, "Node Address",
+                                 self.showAddress(self.node))
 
                 self.show_string(4, 0, "Baseline",
                                  self.baselineStr[self.baselineToggle])
-                self.show_string(5, 0, "Response Time", str(self.duration) +
-                                       " ms " + self.term.cyan("Avg: ") +
-                                       str(self.duration_avg) + " ms   ")
+                self.show_latency(5, 0)
                 neighborCount = "%s" % node['neighbors']
                 if self.incommunicados > 0:
-                    neighborCount += self.term.red(" / %d " %
-                                                   self.incommunicados)
+                    neighborCount += self.styles.red(" / %d " %
+                                                     self.incommunicados)
                 else:
                     neighborCount += "    "
                 self.show_string(6, 2, "Neighbors", neighborCount)
 
+                if self.client is not None:
+                    self.show_string(6, 1, "Connections",
+                                     "%d new / %d reused" %
+                                     (self.client.connections_opened,
+                                      self.client.connections_reused))
+
                 if self.localhost:
                     self.show_string(5, 1, "Load Average", getloadavg())
                 else:
                     self.show_string(5, 1, "Load Average", 'N/A')
 
-                self.show_neighbors(7, neighbors)
+                for i, command in enumerate(self.commands):
+                    self.show_string(7, i, command['command'],
+                                     "%d ms   " % self.latencies[i])
+
+                self.show_data_age(7, 2, now - self.good_time)
+
+                start = monotonic()
+                self.show_neighbors(8)
+                TIMINGS.add('show_neighbors', start)
 
-    def logDuration(self, duration):
-        self.duration = duration
-        self.duration_hist.append(duration)
-        self.duration_avg = int(sum(self.duration_hist) /
-                                len(self.duration_hist))
-        # Limit history to the last 5 minutes of calls
-        if len(self.duration_hist) > (60*5/self.poll_delay):
-            del self.duration_hist[0]
+                self.screen.flush()
+
+    def timeout(self):
+        """
+        Seconds to wait without a snapshot. A quick poll is shown when
+        it completes, a slow one as 'fetch' a blink after it started.
+        A replay shows its clock every second.
+        """
+        if isinstance(self.poller, Replayer):
+            return 1
+        return max(0, self.poller.next_poll - self.poller.now()) + \
+            self.blink_delay
+
+    def relayout(self):
+        """ Lay the screen out for the terminal size, draw it anew """
+        self.height, self.width = self.term.height, self.term.width
+        self.layout = Layout(self.height, self.width,
+                             self.quit_hint + " - "
+                             "B to reset tx to a zero baseline - "
+                             "O to obscure addresses - "
+                             "S# to sort column - "
+                             "D for debug - "
+                             "W for latency window - "
+                             "R for rates - "
+                             "PgUp/PgDn to scroll")
+        self.screen.clear()
+        return self.layout
+
+    def show_data_age(self, row, col, age):
+        """ Show how stale the data on screen is """
+        s = "%.1f s" % age
+        if self.poller.failures:
+            s = self.styles.red(s + " (stale)")
+        elif age > 2 * self.poll_delay:
+            s = self.styles.yellow(s) if age < URL_TIMEOUT + self.poll_delay \
+                else self.styles.red(s)
+        self.show_string(row, col, "Data Age", s + "   ")
+
+    def logDuration(self, duration, now=None):
+        self.latency.add(duration, now)
+
+    def show_latency(self, row, col):
+        """ Last response time and p50/p95/p99/max of one window """
+        name = RollingStats.WINDOWS[self.latency_window][0]
+        stats = self.latency.summaries[name]
+        self.show_string(row, col, "Response Time",
+                         "%d ms " % self.latency.last +
+                         self.styles.cyan(name + ": ") +
+                         "%(p50)d/%(p95)d/%(p99)d/%(max)d" % stats)
 
     def showAddress(self, address):
         if self.obscureAddrToggle == 1:
             return scrambleAddress(address)
         return address
 
-    def getBaselineKey(self, neighbor, subkey):
-        return "%s:%s" % (neighbor['address'], subkey)
-
-    def historizer(self, txtype, wsid, hd, n):
-        nid = "%s-%s" % (n['address'], txtype)
-        nidd = "%s-%sd" % (n['address'], txtype)
-        c = n[wsid]
-        try:
-            p = self.hist[nid]
-            hd[nid] = c
-            if p > 0:
-                hd[nidd] = c - p
-            else:
-                hd[nidd] = 0
-        except KeyError:
-            hd[nid] = 0
-            hd[nidd] = 0
-
-        n["%sDelta" % wsid] = hd[nidd]
+    def historizer(self, neighbors, now=None):
+        """ Store the tx counters of a poll and their delta to the last """
+        start = monotonic()
+        self.table.update(neighbors, now)
+        TIMINGS.add('historizer', start)
 
     def show(self, row, col, label, dictionary, value):
 
-        x1 = (self.width // 3) * col
-        x2 = x1 + 18
+        x1, x2 = self.layout.info[col]
 
-        vs = self.term.bright_cyan(str(dictionary[value]))
+        vs = self.styles.bright_cyan(str(dictionary[value]))
 
         # Highlight if no neighbors
         if value == "neighbors" and dictionary[value] == 0:
-            vs = self.term.red(str(dictionary[value]))
+            vs = self.styles.red(str(dictionary[value]))
 
         # Highlight if latest milestone is out of sync with
         # the solid milestone
@@ -609,45 +2208,41 @@ class IriTop:
               dictionary["latestMilestoneIndex"]
 
             if diff < 0 and diff >= -2:
-                vs = self.term.yellow(
+                vs = self.styles.yellow(
                     str(dictionary[value]) + "*   ")
             elif diff < -2:
-                vs = self.term.red(
+                vs = self.styles.red(
                         str(dictionary[value]) + " (!)")
             else:
                 vs = str(dictionary[value])
-            print(self.term.move(row, x2) + " "*(len(vs)+4))
 
         if value in self.prev and dictionary[value] != self.prev[value]:
-            vs = self.term.on_blue(vs)
+            vs = self.styles.on_blue(vs)
+            self.highlighted = True
 
-        print(self.term.move(row, x1) + self.term.cyan(label + ":"))
-        print(self.term.move(row, x2) + self.term.bright_cyan(vs))
+        self.screen.put(row, x1, self.styles.cyan(label + ":"))
+        self.screen.put(row, x2, self.styles.bright_cyan(vs))
 
         self.prev[value] = dictionary[value]
 
     def show_string(self, row, col, label, value, prev=""):
 
-        x1 = (self.width // 3) * col
-        x2 = x1 + 18
+        x1, x2 = self.layout.info[col]
 
         value = str(value)
         if prev != "" and value != prev:
-            value = self.term.on_blue(value)
+            value = self.styles.on_blue(value)
+            self.highlighted = True
 
-        print(self.term.move(row, x1) + self.term.cyan(label + ":"))
-        print(self.term.move(row, x2) +
-              self.term.bright_cyan(str(value) + "  "))
+        self.screen.put(row, x1, self.styles.cyan(label + ":"))
+        self.screen.put(row, x2,
+                        self.styles.bright_cyan(str(value) + "  "))
 
     def show_histogram(self, row, col, label, value, value_max,
                        warning_limit=0.8, span=1):
 
-        label_width = 18
-        col_width = ((self.width // 3) - label_width) + \
-                    ((span - 1) * (self.width // 3))
-        x1 = (self.width // 3) * col
-        x2 = x1 + label_width
-        bw = col_width - 2
+        x1, x2 = self.layout.info[col]
+        bw = self.layout.bars[span]
 
         vm = bw
         v = int(value / value_max * bw)
@@ -665,141 +2260,1469 @@ class IriTop:
             mY = mG
             mG = 0
 
-        print(self.term.move(row, x1) + self.term.cyan(label + ":"))
-        print(self.term.move(row, x2) +
-              self.term.white("[") +
-              self.term.green("|" * mG) +
-              self.term.yellow("|" * mY) +
-              self.term.red("#" * mR) +
-              self.term.bright_black("-" * mB) +
-              self.term.white("]"))
+        self.screen.put(row, x1, self.styles.cyan(label + ":"))
+        self.screen.put(row, x2,
+                        self.styles.white("[") +
+                        self.styles.green("|" * mG) +
+                        self.styles.yellow("|" * mY) +
+                        self.styles.red("#" * mR) +
+                        self.styles.bright_black("-" * mB) +
+                        self.styles.white("]"))
 
-    def show_neighbors(self, row, neighbors):
+    def show_neighbors(self, row):
         global ITER
-        cols = 9
-        height, width = self.term.height, self.term.width
-        cw = width // cols
-        cw1 = width - ((cols - 1) * cw)
-        cwl = [0, ]
-        for c in range(cols - 1):
-            cwl.append(cw1 + (c * cw))
+        layout = self.layout or self.relayout()
+        height = layout.height
+        cw, cwl = layout.column_width, layout.column_starts
 
+        rows = self.table.rows
         self.incommunicados = 0
         revso = True if self.sortorder == self.sortorderlist[2] else False
-
-        for k in self.txkeys:
-            ch = k['header'] + (' [%s]' % k['sortkey'] if self.sortmode
-                                else (self.sortorderlist[1] if revso
-                                      else self.sortorderlist[2])
-                                if self.sortcolumn == k['sortcolumn']
-                                else '')
-            ch += "" if k['keyshort'] != 'ad' else " "*(cw*4-len(ch))
-            print(self.term.move(row, cwl[k['col']]) +
-                  self.term.black_on_green(ch.rjust(cw)))
+        mode = self.rate_modes[self.rate_mode]
+
+        # Leave room for the debug pane above the footer
+        debug = self.debug_info() if self.debugToggle else []
+        bottom = height - len(debug)
+
+        # Viewport below the header row
+        self.page_size = max(1, bottom - 3 - row)
+        self.scroll = max(0, min(self.scroll, len(rows) - self.page_size))
+
+        scrolled = None
+        if len(rows) > self.page_size:
+            scrolled = " (%d-%d of %d)" % (
+                self.scroll + 1,
+                min(len(rows), self.scroll + self.page_size),
+                len(rows))
+        state = (self.sortmode, self.sortcolumn, revso, mode, scrolled)
+        if state not in layout.headers:
+            layout.headers[state] = self.headers(cw, cwl, revso, mode,
+                                                 scrolled)
+        for col, header in layout.headers[state]:
+            self.screen.put(row, col, header)
 
         row += 1
 
         # Sort neighbors
-        ordered_neighbors = []
         if self.sortcolumn is None:
             self.sortorder = None
-            ordered_neighbors = neighbors
+            ordered_rows = rows
         else:
             if self.sortorder is None:
                 self.sortorder = self.sortorderlist[0]
-            ordered_neighbors = sorted(neighbors,
-                                       key=lambda k: k[self.sortcolumn],
-                                       reverse=revso)
-
-        # Show Neighbors
-        for neighbor in ordered_neighbors:
-            self.show_neighbor(row, neighbor, cwl, cw, height)
-            row += 1
+            start = monotonic()
+            ordered_rows = self.table.sorted_rows(self.sortcolumn, revso,
+                                                  mode)
+            TIMINGS.add('sort', start)
+
+        # Only the rows in the viewport are formatted and drawn
+        first, last = self.scroll, self.scroll + self.page_size
+
+        for i, slot in enumerate(ordered_rows):
+            if first <= i < last:
+                self.show_neighbor(row, slot, cwl, cw)
+                row += 1
+            else:
+                self.track_neighbor(slot)
 
-        # Blank spare neighbor rows
-        for blankrow in range(row, height - 2):
-            print(self.term.move(blankrow, 0) + " " * width)
+        for i, (label, value) in enumerate(debug):
+            self.show_string(bottom - 2 + i, 0, label, value)
 
-        print(self.term.move(height - 2, 0 * cw) +
-              self.term.black_on_cyan(
-                    "Q to exit - "
-                    "B to reset tx to a zero baseline - "
-                    "O to obscure addresses - "
-                    "S# to sort column".ljust(width)))
+        self.screen.put(height - 2, 0,
+                        self.styles.black_on_cyan(layout.footer))
 
         ITER += 1
 
-    def txString(self, neighbor, key, keydelta, keyshort, column_width):
-        txcnt = neighbor[key] - (self.baseline[self.getBaselineKey(neighbor,
-                                 keyshort)] * self.baselineToggle)
-        return ("%d (%d)" % (txcnt, neighbor[keydelta])).rjust(column_width)
+    def headers(self, cw, cwl, revso, mode, scrolled):
+        """ Position and text of each neighbor table header """
+        headers = []
+        for k in self.txkeys:
+            header = k['header']
+            if mode is not None and k['keyshort'] != 'ad':
+                header += '/s'
+            ch = header + (' [%s]' % k['sortkey'] if self.sortmode
+                           else (self.sortorderlist[1] if revso
+                                 else self.sortorderlist[2])
+                           if self.sortcolumn == k['sortcolumn']
+                           else '')
+            if k['keyshort'] == 'ad' and scrolled is not None:
+                ch += scrolled
+            if k['keyshort'] == 'ad' and mode not in (None, 'rate'):
+                ch += " %s avg" % mode
+            ch += "" if k['keyshort'] != 'ad' else " "*(cw*4-len(ch))
+            headers.append((cwl[k['col']],
+                            self.styles.black_on_green(ch.rjust(cw))))
+        return headers
+
+    def debug_info(self):
+        """ Label and value of each line of the debug pane """
+        screen = self.screen
+        table = self.table
+        return [("Frame Output",
+                 "%d bytes in %d writes, avg %d bytes/frame over %d frames" %
+                 (screen.frame_bytes, screen.frame_writes,
+                  screen.bytes // max(1, screen.frames), screen.frames)),
+                ("Tracked",
+                 "%d neighbors (max %d), %d evicted, %d untracked" %
+                 (len(table), table.max_tracked, table.evicted,
+                  table.untracked)),
+                ("Wakeups", self.events.stats()),
+                ("Fetch Phases", TIMINGS.summary(Timings.FETCH)),
+                ("Frame Phases", TIMINGS.summary(Timings.FRAME)),
+                ("Polls",
+                 "%d failed of %d, last error: %s" %
+                 (self.poller.errors, self.poller.seq,
+                  self.poller.last_error)),
+                ("Latency", "  ".join(
+                    ("%s p50/95/99/max " % name) +
+                    ("%(p50)d/%(p95)d/%(p99)d/%(max)d ms" %
+                     self.latency.summaries[name])
+                    for name, _ in RollingStats.WINDOWS))]
+
+    def txString(self, slot, c, column_width):
+        table = self.table
+        mode = self.rate_modes[self.rate_mode]
+        if mode is not None:
+            return ("%.1f" % table.values(c, mode)[slot]).rjust(column_width)
+        txcnt = table.current[c][slot] - (table.baseline[c][slot] *
+                                          self.baselineToggle)
+        return ("%d (%d)" % (txcnt, table.delta[c][slot])).rjust(column_width)
+
+    def is_incommunicado(self, slot):
+        return (self.table.delta[self.all_tx][slot] == 0 and
+                ITER > (6 * self.poll_delay))
+
+    def store_drawn(self, slot):
+        for drawn, current in zip(self.table.drawn, self.table.current):
+            drawn[slot] = current[slot]
+
+    def track_neighbor(self, slot):
+        """ Bookkeeping for a neighbor outside of the viewport """
+        if self.is_incommunicado(slot):
+            self.incommunicados += 1
+        self.store_drawn(slot)
 
-    def show_neighbor(self, row, neighbor, column_start_list,
-                      column_width, height):
-        global ITER
+    def show_neighbor(self, row, slot, column_start_list, column_width):
+        table = self.table
 
-        neighbor['addr'] = self.showAddress(neighbor['connectionType'] +
-                                            "://" + neighbor['address'])
+        addr = self.showAddress(table.connection_types[slot] + "://" +
+                                table.addresses[slot])
 
         # Create display string
-        for txkey in self.txkeys[1:]:
-            neighbor[txkey['keyshort']] = \
-                    self.txString(neighbor,
-                                  txkey['key'],
-                                  '%sDelta' % txkey['key'],
-                                  txkey['keyshort'],
-                                  column_width)
+        tx = [self.txString(slot, c, column_width)
+              for c in range(len(table.counters))]
 
         # Highlight neighbors that are incommunicado
         incommunicado = False
-        if (neighbor['numberOfAllTransactionsDelta'] == 0 and
-                ITER > (6 * self.poll_delay)):
-            neighbor['addr'] = "(!) " + neighbor['addr']
+        if self.is_incommunicado(slot):
+            addr = "(!) " + addr
             incommunicado = True
             self.incommunicados += 1
 
         # Pad/Trim neighbor address
-        ncolw = 3 * (column_width + 1)
-        if len(neighbor['addr']) < ncolw:
+        ncolw = self.layout.address_width
+        if len(addr) < ncolw:
             # pad
-            neighbor['addr'] = neighbor['addr'].ljust(ncolw, ' ')
-        elif len(neighbor['addr']) > ncolw:
+            addr = addr.ljust(ncolw, ' ')
+        elif len(addr) > ncolw:
             # trim
-            neighbor['addr'] = neighbor['addr'][0:ncolw]
+            addr = addr[0:ncolw]
 
-        value_at = "neighbor-%s-at" % neighbor['address']
-        if (value_at in self.prev and
-                neighbor['numberOfAllTransactions'] != self.prev[value_at]):
-            neighbor['at'] = self.term.cyan(neighbor['at'])
-
-        if neighbor['numberOfInvalidTransactions'] > 0:
-            neighbor['it'] = \
-                self.term.red(str(neighbor['numberOfInvalidTransactions'])
-                              .rjust(column_width))
+        invalid = table.current[self.invalid_tx][slot]
+        if invalid > 0 and self.rate_modes[self.rate_mode] is not None:
+            tx[self.invalid_tx] = self.styles.red(tx[self.invalid_tx])
+        elif invalid > 0:
+            tx[self.invalid_tx] = self.styles.red(str(invalid)
+                                                  .rjust(column_width))
 
         # Blink changed value
-        for txkey in self.txkeys[1:]:
-            neighborkey = "neighbor-%s-%s" % (neighbor['address'],
-                                              txkey['keyshort'])
-            if (neighborkey in self.prev and
-                    neighbor[txkey['key']] != self.prev[neighborkey]):
-                neighbor[txkey['keyshort']] = \
-                    self.term.cyan(neighbor[txkey['keyshort']])
-
-        # do not display any neighbors crossing the height of the terminal
-        if row < height - 2:
-            print(self.term.move(row, column_start_list[0]) +
-                  (self.term.white(neighbor['addr']) if not incommunicado
-                  else self.term.red(neighbor['addr'])))
-            for txkey in self.txkeys[1:]:
-                print(self.term.move(row, column_start_list[txkey['col']]) +
-                      self.term.green(neighbor[txkey['keyshort']]))
-
-        # Store previous value
-        for txkey in self.txkeys[1:]:
-            neighborkey = "neighbor-%s-%s" % (neighbor['address'],
-                                              txkey['keyshort'])
-            self.prev[neighborkey] = neighbor[txkey['key']]
+        for c in range(len(table.counters)):
+            if (table.drawn[c][slot] >= 0 and
+                    table.current[c][slot] != table.drawn[c][slot]):
+                tx[c] = self.styles.cyan(tx[c])
+                self.highlighted = True
+
+        self.screen.put(row, column_start_list[0],
+                        self.styles.white(addr)
+                        if not incommunicado
+                        else self.styles.red(addr))
+        for c, txkey in enumerate(self.txkeys[1:]):
+            self.screen.put(row, column_start_list[txkey['col']],
+                            self.styles.green(tx[c]))
+
+        self.store_drawn(slot)
+
+
+class FleetTop:
+
+    """
+    Summary view of a fleet of nodes, one row per node, polled
+    concurrently. Any node can be opened in the IriTop neighbor view.
+    """
+
+    def __init__(self, args):
+        self.term = terminal()
+        self.screen = Screen(self.term)
+        self.styles = Styles(self.term)
+        self.events = Events(self.term)
+        self.args = args
+        self.poll_delay = args.poll_delay
+        self.blink_delay = args.blink_delay
+        self.obscureAddrToggle = args.obscure_address
+        self.workers = args.workers
+        self.selected = 0
+        self.offset = 0
+        self.width = 0
+        self.height = 0
+        self.tops = {}
+
+        """ Columns following the node address: header, width """
+        self.columns = [('Milestone Lag', 14),
+                        ('Neighbors', 11),
+                        ('Tips', 8),
+                        ('Memory', 16),
+                        ('Response', 11),
+                        ('Data Age', 10)]
+
+        set_auth_header(args)
+        self.clients = [node_client(node, args) for node in args.nodes]
+
+    def run(self, stdscr):
+
+        """ Clear the screen on start """
+        stdscr.clear()
+
+        self.screen.message("IRITop connecting to %d nodes..." %
+                            len(self.clients))
+
+        self.fleet = FleetPoller(self.clients, COMMANDS, self.poll_delay,
+                                 self.workers, self.args.intervals)
+        sinks = start_sinks(self.args, self.fleet.pollers.values())
+        self.fleet.start()
+        try:
+            self.loop()
+        finally:
+            self.fleet.stop()
+            for sink in sinks:
+                sink.stop()
+
+    def loop(self):
+        nodes = list(self.fleet.pollers.keys())
+
+        events = self.events.watching(self.fleet.pollers.values())
+        with self.term.hidden_cursor(), events:
+            val = ""
+            while val.lower() != 'q':
+
+                """ Exit if max cycles specified """
+                if int(MAX_CYCLES) != 0 and \
+                        self.fleet.ticks >= int(MAX_CYCLES):
+                    break
+
+                """ Data ages go up by the second """
+                events.after(1)
+                val = events.wait()
+
+                if val.code == self.term.KEY_UP:
+                    self.selected = max(0, self.selected - 1)
+                elif val.code == self.term.KEY_DOWN:
+                    self.selected = min(len(nodes) - 1, self.selected + 1)
+                elif val.code == self.term.KEY_ENTER or val in ('\n', '\r'):
+                    self.drill(nodes[self.selected])
+                    events.resized = True
+                    self.height = 0
+                    val = ""
+                    continue
+
+                if val.lower() == 'o':
+                    self.obscureAddrToggle = self.obscureAddrToggle ^ 1
+
+                if events.changed((self.height, self.width)):
+                    self.height, self.width = \
+                        self.term.height, self.term.width
+                    self.screen.clear()
+
+                self.show_fleet(nodes)
+                self.screen.flush()
+
+    def drill(self, node):
+        """ Show the neighbor view of one node until Q is pressed """
+        poller = self.fleet.pollers[node]
+        if poller.snapshot is None or poller.snapshot.node is None:
+            return
+
+        if node not in self.tops:
+            self.tops[node] = IriTop(self.args, node=node, term=self.term,
+                                     client=poller.client,
+                                     quit_hint="Q to return to fleet")
+        top = self.tops[node]
+        top.poller = poller
+        top.obscureAddrToggle = self.obscureAddrToggle
+
+        top.screen.clear()
+        top.loop()
+        self.obscureAddrToggle = top.obscureAddrToggle
+        self.screen.clear()
+
+    def showAddress(self, address):
+        if self.obscureAddrToggle == 1:
+            return scrambleAddress(address)
+        return address
+
+    def show_fleet(self, nodes):
+        width, height = self.width, self.height
+        ncolw = width - sum(w for _, w in self.columns)
+
+        self.screen.put(0, 0, self.styles.black_on_cyan(
+                        ("IRITop - Simple IOTA IRI Node Monitor (%s) - %d "
+                         "nodes" % (__VERSION__, len(nodes))).ljust(width)))
+
+        self.screen.put(1, 0, self.styles.cyan("Poll Cycles: ") +
+                        self.styles.bright_cyan(str(self.fleet.ticks)) +
+                        self.styles.cyan("  Skipped (in flight): ") +
+                        self.styles.bright_cyan(str(self.fleet.skipped)))
+
+        header = "Node Address".ljust(ncolw)
+        for title, w in self.columns:
+            header += title.rjust(w)
+        self.screen.put(2, 0, self.styles.black_on_green(header))
+
+        """ Keep the selected node visible """
+        rows = max(1, height - 5)
+        if self.selected < self.offset:
+            self.offset = self.selected
+        elif self.selected >= self.offset + rows:
+            self.offset = self.selected - rows + 1
+
+        row = 3
+        for i in range(self.offset, min(len(nodes), self.offset + rows)):
+            self.show_node(row, nodes[i], ncolw, i == self.selected)
+            row += 1
+
+        self.screen.put(height - 2, 0,
+                        self.styles.black_on_cyan(
+                            "Q to exit - "
+                            "Up/Down to select - "
+                            "Enter to show neighbors - "
+                            "O to obscure addresses".ljust(width)))
+
+    def show_node(self, row, node, ncolw, selected):
+        snapshot = self.fleet.pollers[node].snapshot
+        addr = self.showAddress(node)[:ncolw - 1].ljust(ncolw)
+        addr = self.styles.black_on_white(addr) if selected \
+            else self.styles.white(addr)
+
+        values = []
+        if snapshot is None:
+            values = [self.styles.bright_black("-".rjust(w))
+                      for _, w in self.columns]
+        elif snapshot.node is None:
+            values = [self.styles.red("error".rjust(w))
+                      for _, w in self.columns]
+        else:
+            info = snapshot.node
+            lag = info["latestMilestoneIndex"] - \
+                info["latestSolidSubtangleMilestoneIndex"]
+            used = info["jreTotalMemory"] - info["jreFreeMemory"]
+            age = time.time() - snapshot.time
+            stale = snapshot.error is not None
+            cells = [("%d" % lag,
+                      self.styles.red if lag > 2 else
+                      self.styles.yellow if lag > 0 else self.styles.green),
+                     ("%d" % info["neighbors"],
+                      self.styles.red if info["neighbors"] == 0
+                      else self.styles.green),
+                     ("%d" % info["tips"], self.styles.green),
+                     ("%d/%d Mb" % (used // MB, info["jreMaxMemory"] // MB),
+                      self.styles.red if used > 0.8 * info["jreMaxMemory"]
+                      else self.styles.green),
+                     ("%d ms" % snapshot.duration, self.styles.green),
+                     ("stale" if stale else "%.1f s" % age,
+                      self.styles.red if stale else
+                      self.styles.yellow if age > 2 * self.poll_delay
+                      else self.styles.green)]
+            for (value, style), (_, w) in zip(cells, self.columns):
+                values.append(style(value.rjust(w)))
+
+        self.screen.put(row, 0, addr + "".join(values))
+
+
+class Headless:
+
+    """
+    Polls the node(s) without a terminal and writes one record per
+    poll to stdout or a file, as JSON Lines or CSV, so the data can be
+    piped into other tools. Deltas come from the same NeighborTable
+    logic as the terminal view.
+
+    A JSON Lines record holds the raw getNodeInfo and getNeighbors
+    responses, each neighbor extended with a <counter>Delta field.
+    CSV has one row per neighbor per poll.
+    """
+
+    def __init__(self, args, stream=None):
+        self.format = args.format
+        self.output = args.output
+        self.args = args
+        self.poll_delay = args.poll_delay
+        self.stream = stream
+        self.records = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.broken = False
+
+        set_auth_header(args)
+        self.clients = [node_client(node, args) for node in args.nodes]
+        self.tables = dict((node,
+                            NeighborTable(COUNTERS,
+                                          ttl=args.neighbor_ttl,
+                                          max_tracked=args.
+                                          max_tracked_neighbors))
+                           for node in args.nodes)
+
+    def run(self):
+        opened = self.stream is None and self.output is not None
+        if self.stream is None:
+            self.stream = sys.stdout if self.output is None \
+                else open(self.output, 'a')
+        if self.format == 'csv':
+            self.csv = csv.writer(self.stream)
+            if self.output is None or self.stream.tell() == 0:
+                self.csv.writerow(self.csv_header())
+
+        self.fleet = FleetPoller(self.clients, COMMANDS, self.poll_delay,
+                                 self.args.workers, self.args.intervals)
+        for poller in self.fleet.pollers.values():
+            poller.subscribe(self.write)
+        sinks = start_sinks(self.args, self.fleet.pollers.values())
+        self.fleet.start()
+        try:
+            while not self.done.wait(1):
+                if not self.fleet.alive():
+                    sys.stderr.write("Polling stopped, exiting\n")
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.fleet.stop()
+            for sink in sinks:
+                sink.stop()
+            if self.broken:
+                self.discard_stream()
+            else:
+                self.stream.flush()
+            if opened:
+                self.stream.close()
+
+    def discard_stream(self):
+        """ Reader went away, don't fail flushing stdout on exit """
+        if self.stream is sys.stdout:
+            try:
+                dup2(os_open(devnull, O_WRONLY), sys.stdout.fileno())
+            except (OSError, ValueError):
+                pass
+
+    def write(self, snapshot):
+        table = self.tables[snapshot.url]
+        with self.lock:
+            if self.broken:
+                return
+            table.update(snapshot.neighbors, snapshot.clock)
+            try:
+                if self.format == 'csv':
+                    self.csv.writerows(self.csv_rows(snapshot, table))
+                else:
+                    self.stream.write(json.dumps(
+                        self.record(snapshot, table)) + "\n")
+                self.stream.flush()
+            except IOError as e:
+                """ Piped into head or a closed socket, stop polling """
+                if e.errno != errno.EPIPE:
+                    report_error("headless output", e)
+                self.broken = True
+                self.done.set()
+                return
+
+            """ Exit if max cycles specified """
+            self.records += 1
+            if (int(MAX_CYCLES) != 0 and
+                    self.records >= int(MAX_CYCLES) * len(self.clients)):
+                self.done.set()
+
+    def deltas(self, neighbor, table):
+        slot = table.slots.get(neighbor['address'])
+        return [0 if slot is None else delta[slot] for delta in table.delta]
+
+    def record(self, snapshot, table):
+        neighbors = []
+        for neighbor in snapshot.neighbors:
+            neighbor = dict(neighbor)
+            for key, delta in zip(COUNTERS, self.deltas(neighbor, table)):
+                neighbor[key + 'Delta'] = delta
+            neighbors.append(neighbor)
+
+        return {'time': round(snapshot.time, 3),
+                'node': snapshot.url,
+                'duration': snapshot.duration,
+                'latencies': dict((command['command'], latency)
+                                  for command, latency in
+                                  zip(COMMANDS, snapshot.latencies)),
+                'error': None if snapshot.error is None
+                else str(snapshot.error),
+                'nodeInfo': snapshot.node,
+                'neighbors': neighbors}
+
+    @staticmethod
+    def csv_header():
+        return (['time', 'node', 'latestMilestoneIndex',
+                 'latestSolidSubtangleMilestoneIndex', 'duration', 'error',
+                 'address', 'connectionType'] +
+                COUNTERS + [key + 'Delta' for key in COUNTERS])
+
+    def csv_rows(self, snapshot, table):
+        info = snapshot.node or {}
+        poll = ["%.3f" % snapshot.time, snapshot.url,
+                info.get('latestMilestoneIndex', ''),
+                info.get('latestSolidSubtangleMilestoneIndex', ''),
+                snapshot.duration,
+                '' if snapshot.error is None else str(snapshot.error)]
+
+        if not snapshot.neighbors:
+            return [poll + [''] * (2 + 2 * len(COUNTERS))]
+        return [poll +
+                [neighbor['address'], neighbor['connectionType']] +
+                [neighbor.get(key, 0) for key in COUNTERS] +
+                self.deltas(neighbor, table)
+                for neighbor in snapshot.neighbors]
+
+
+def start_sinks(args, pollers):
+    """ Start the exporter and recorder asked for, fed by the pollers """
+    sinks = []
+    if args.export_port is not None:
+        sinks.append(Exporter(args.export_port))
+    if args.record is not None:
+        sinks.append(Recorder(args.record))
+    for sink in sinks:
+        for poller in pollers:
+            sink.watch(poller)
+        sink.start()
+    return sinks
+
+
+def metric_name(key):
+    """ numberOfAllTransactions -> all_transactions """
+    key = re.sub(r'^numberOf', '', key)
+    return re.sub(r'(?<!^)([A-Z])', r'_\1', key).lower()
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace(
+        '"', '\\"').replace('\n', '\\n')
+
+
+def metrics_server(address, port):
+    """ Scrape server, http.server is only imported for --export-port """
+    try:
+        from BaseHTTPServer import (HTTPServer,  # python 2
+                                    BaseHTTPRequestHandler)
+        from SocketServer import ThreadingMixIn
+    except ImportError:
+        from http.server import (HTTPServer,  # python 3
+                                 BaseHTTPRequestHandler)
+        from socketserver import ThreadingMixIn
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        """ Answers scrapes with the exporter's cached metrics """
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = self.server.exporter.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            return
+
+    class MetricsServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    return MetricsServer((address, port), MetricsHandler)
+
+
+class Exporter:
+
+    """
+    Prometheus /metrics endpoint fed by the pollers' snapshots.
+
+    Every snapshot is recorded as it is published; a scrape only
+    renders what was recorded and never calls the node, so any
+    number of scrapers costs the node nothing. The rendered text is
+    cached until the next snapshot arrives.
+    """
+
+    def __init__(self, port, address=''):
+        self.lock = threading.Lock()
+        self.nodes = OrderedDict()
+        self.body = None
+        self.scrapes = 0
+        self.server = metrics_server(address, port)
+        self.server.exporter = self
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def watch(self, poller):
+        commands = [c['command'] for c in poller.commands]
+        with self.lock:
+            self.nodes[poller.client.node] = {
+                'polls': 0,
+                'errors': 0,
+                'up': 0,
+                'time': None,
+                'node': None,
+                'neighbors': (),
+                'buckets': dict((c, [0] * len(LATENCY_BUCKETS))
+                                for c in commands),
+                'count': dict((c, 0) for c in commands),
+                'sum': dict((c, 0.0) for c in commands)}
+        poller.subscribe(lambda snapshot: self.observe(snapshot, commands))
+
+    def observe(self, snapshot, commands):
+        with self.lock:
+            state = self.nodes[snapshot.url]
+            state['polls'] += 1
+            self.body = None
+            if snapshot.error is not None:
+                state['errors'] += 1
+                state['up'] = 0
+                return
+
+            """ Keep serving the last good values while the node is down """
+            state['up'] = 1
+            state['time'] = snapshot.time
+            state['node'] = snapshot.node
+            state['neighbors'] = snapshot.neighbors
+            for command, latency in zip(commands, snapshot.latencies):
+                if latency is None:
+                    continue
+                seconds = latency / 1000.0
+                state['count'][command] += 1
+                state['sum'][command] += seconds
+                buckets = state['buckets'][command]
+                for i, bound in enumerate(LATENCY_BUCKETS):
+                    if seconds <= bound:
+                        buckets[i] += 1
+
+    def render(self):
+        with self.lock:
+            self.scrapes += 1
+            if self.body is None:
+                self.body = "".join(self.lines())
+            return self.body
+
+    def lines(self):
+        def family(name, kind, text, samples):
+            yield "# HELP %s %s\n" % (name, text)
+            yield "# TYPE %s %s\n" % (name, kind)
+            for labels, value in samples:
+                yield "%s{%s} %s\n" % (name, ",".join(
+                    '%s="%s"' % (k, label(v)) for k, v in labels), value)
+
+        nodes = self.nodes.items()
+        for name, text, key in [('iri_up', 'Last poll of the node succeeded',
+                                 'up'),
+                                ('iritop_polls_total', 'Polls of the node',
+                                 'polls'),
+                                ('iritop_poll_errors_total',
+                                 'Failed polls of the node', 'errors')]:
+            kind = 'gauge' if key == 'up' else 'counter'
+            for line in family(name, kind, text,
+                               [((('node', url),), state[key])
+                                for url, state in nodes]):
+                yield line
+
+        for line in family('iritop_last_poll_timestamp_seconds', 'gauge',
+                           'Time of the last successful poll',
+                           [((('node', url),), '%.3f' % state['time'])
+                            for url, state in nodes
+                            if state['time'] is not None]):
+            yield line
+
+        for key, name, text in NODE_METRICS:
+            for line in family(name, 'gauge', text,
+                               [((('node', url),), state['node'][key])
+                                for url, state in nodes
+                                if state['node'] is not None and
+                                key in state['node']]):
+                yield line
+
+        for key in COUNTERS:
+            name = 'iri_neighbor_%s_total' % metric_name(key)
+            for line in family(name, 'counter', 'Neighbor %s' %
+                               metric_name(key).replace('_', ' '),
+                               [((('node', url),
+                                  ('address', n['address']),
+                                  ('connection_type',
+                                   n.get('connectionType', ''))),
+                                 n.get(key, 0))
+                                for url, state in nodes
+                                for n in state['neighbors']]):
+                yield line
+
+        name = 'iritop_fetch_duration_seconds'
+        yield "# HELP %s Response time of node API calls\n" % name
+        yield "# TYPE %s histogram\n" % name
+        for url, state in nodes:
+            for command, buckets in state['buckets'].items():
+                labels = 'node="%s",command="%s"' % (label(url), command)
+                count = state['count'][command]
+                for bound, hits in zip(LATENCY_BUCKETS, buckets):
+                    yield '%s_bucket{%s,le="%s"} %d\n' % (
+                        name, labels, bound, hits)
+                yield '%s_bucket{%s,le="+Inf"} %d\n' % (name, labels, count)
+                yield '%s_sum{%s} %.3f\n' % (
+                    name, labels, state['sum'][command])
+                yield '%s_count{%s} %d\n' % (name, labels, count)
+
+
+def put_varint(buf, value):
+    while value > 0x7f:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def get_varint(buf, pos):
+    """ Return the varint at pos and the position after it """
+    value = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# Recorded field value tags
+TAG_INT, TAG_STR, TAG_JSON, TAG_GONE = range(4)
+
+# Frame flags
+HAS_NODE, HAS_ERROR, SAME_NEIGHBORS, LATENCY_GAPS = 1, 2, 4, 8
+
+# Neighbor flags, following one bit per counter
+NEW_TYPE = 1 << len(COUNTERS)
+NEW_FIELDS = 2 << len(COUNTERS)
+
+Block = namedtuple('Block', ['offset', 'start', 'end', 'first_milestone',
+                             'last_milestone', 'frames', 'length'])
+
+
+class BlockEncoder:
+
+    """
+    Encodes snapshots into one self-contained block of a session file.
+
+    Strings (addresses, field names) are interned per block: the first
+    use writes the text, later uses its number. Each node's first frame
+    in a block is a keyframe holding absolute values; later frames only
+    hold changed getNodeInfo fields and, per neighbor, the change of
+    each counter's delta, which for steadily increasing counters is
+    mostly zero and fits in a byte otherwise. Numbers are zigzag
+    varints.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.strings = {}
+        self.nodes = {}
+        self.frames = 0
+        self.start = None
+        self.end = None
+        self.milestones = []
+
+    def string(self, text):
+        ref = self.strings.get(text)
+        if ref is not None:
+            put_varint(self.buf, ref + 1)
+            return
+        self.strings[text] = len(self.strings)
+        data = text.encode('utf-8')
+        put_varint(self.buf, 0)
+        put_varint(self.buf, len(data))
+        self.buf.extend(data)
+
+    def fields(self, values, prev):
+        """ Write the fields that differ from prev, then update prev """
+        changed = [k for k in values
+                   if k not in prev or prev[k] != values[k] or
+                   type(prev[k]) is not type(values[k])]
+        removed = [k for k in prev if k not in values]
+        put_varint(self.buf, len(changed) + len(removed))
+        for key in changed:
+            value = values[key]
+            self.string(key)
+            if is_integer(value):
+                base = prev.get(key)
+                put_varint(self.buf, TAG_INT)
+                put_varint(self.buf, zigzag(value - base
+                                            if is_integer(base) else value))
+            elif isinstance(value, type(u'')):
+                put_varint(self.buf, TAG_STR)
+                self.string(value)
+            else:
+                put_varint(self.buf, TAG_JSON)
+                self.string(json.dumps(value, sort_keys=True))
+        for key in removed:
+            self.string(key)
+            put_varint(self.buf, TAG_GONE)
+        prev.clear()
+        prev.update(values)
+
+    def frame(self, snapshot):
+        ms = int(round(snapshot.time * 1000))
+        if self.start is None:
+            self.start = ms
+        self.end = ms
+        self.frames += 1
+        state = self.nodes.setdefault(snapshot.url, {'time': self.start,
+                                                     'clock': None,
+                                                     'node': {},
+                                                     'neighbors': {}})
+
+        """ Polls that did not refresh the neighbors only say so """
+        same = snapshot.clock is not None and \
+            snapshot.clock == state['clock']
+        state['clock'] = snapshot.clock
+        gaps = None in snapshot.latencies
+        flags = ((HAS_NODE if snapshot.node is not None else 0) |
+                 (HAS_ERROR if snapshot.error is not None else 0) |
+                 (SAME_NEIGHBORS if same else 0) |
+                 (LATENCY_GAPS if gaps else 0))
+        self.string(snapshot.url)
+        put_varint(self.buf, zigzag(ms - state['time']))
+        state['time'] = ms
+        put_varint(self.buf, flags)
+        put_varint(self.buf, snapshot.duration)
+        put_varint(self.buf, len(snapshot.latencies))
+        for latency in snapshot.latencies:
+            if gaps:
+                put_varint(self.buf, 0 if latency is None else
+                           int(latency) + 1)
+            else:
+                put_varint(self.buf, int(latency))
+        if snapshot.error is not None:
+            self.string(u'%s' % snapshot.error)
+        if snapshot.node is not None:
+            self.fields(snapshot.node, state['node'])
+            milestone = snapshot.node.get('latestMilestoneIndex')
+            if is_integer(milestone):
+                self.milestones.append(milestone)
+        if not same:
+            self.neighbors(snapshot.neighbors, state)
+
+    def neighbors(self, neighbors, state):
+        prev = state['neighbors']
+        current = {}
+        put_varint(self.buf, len(neighbors))
+        for neighbor in neighbors:
+            address = neighbor.get('address', u'')
+            kind = neighbor.get('connectionType', u'')
+            values = [int(neighbor.get(key) or 0) for key in COUNTERS]
+            extra = dict((k, v) for k, v in neighbor.items()
+                         if k != 'address' and k != 'connectionType' and
+                         k not in COUNTERS)
+            last = prev.get(address)
+            if last is None:
+                """ New neighbor: absolute values, no rate yet """
+                changes = values
+                deltas = [0] * len(COUNTERS)
+                last = [None, None, None, {}]
+            else:
+                deltas = [v - p for v, p in zip(values, last[0])]
+                changes = [d - p for d, p in zip(deltas, last[1])]
+
+            flags = 0
+            for i, change in enumerate(changes):
+                if change:
+                    flags |= 1 << i
+            if kind != last[2]:
+                flags |= NEW_TYPE
+            if extra != last[3]:
+                flags |= NEW_FIELDS
+
+            self.string(address)
+            put_varint(self.buf, flags)
+            for change in changes:
+                if change:
+                    put_varint(self.buf, zigzag(change))
+            if flags & NEW_TYPE:
+                self.string(kind)
+            if flags & NEW_FIELDS:
+                self.fields(extra, last[3])
+            current[address] = [values, deltas, kind, last[3]]
+        state['neighbors'] = current
+
+    def block(self):
+        """ Header and compressed frames, ready to append to the file """
+        payload = zlib.compress(bytes(self.buf))
+        first = min(self.milestones) if self.milestones else 0
+        last = max(self.milestones) if self.milestones else 0
+        header = bytearray()
+        for value in (self.start, self.end - self.start, first, last - first,
+                      self.frames, len(payload)):
+            put_varint(header, value)
+        return bytes(header) + payload
+
+
+class BlockDecoder:
+
+    """ Decodes the snapshots of one block, mirroring BlockEncoder """
+
+    def __init__(self, payload):
+        self.buf = bytearray(zlib.decompress(payload))
+        self.pos = 0
+        self.strings = []
+        self.nodes = {}
+
+    def varint(self):
+        value, self.pos = get_varint(self.buf, self.pos)
+        return value
+
+    def string(self):
+        ref = self.varint()
+        if ref:
+            return self.strings[ref - 1]
+        length = self.varint()
+        text = bytes(self.buf[self.pos:self.pos + length]).decode('utf-8')
+        self.pos += length
+        self.strings.append(text)
+        return text
+
+    def fields(self, prev):
+        for _ in range(self.varint()):
+            key = self.string()
+            tag = self.varint()
+            if tag == TAG_INT:
+                base = prev.get(key)
+                change = unzigzag(self.varint())
+                prev[key] = change + base if is_integer(base) else change
+            elif tag == TAG_STR:
+                prev[key] = self.string()
+            elif tag == TAG_JSON:
+                prev[key] = json.loads(self.string())
+            else:
+                del prev[key]
+        return prev
+
+    def frames(self, start):
+        while self.pos < len(self.buf):
+            yield self.frame(start)
+
+    def frame(self, start):
+        url = self.string()
+        state = self.nodes.setdefault(url, {'time': start, 'clock': None,
+                                            'node': {}, 'neighbors': {},
+                                            'polled': ()})
+        state['time'] += unzigzag(self.varint())
+        flags = self.varint()
+        duration = self.varint()
+        latencies = tuple(self.varint() for _ in range(self.varint()))
+        if flags & LATENCY_GAPS:
+            latencies = tuple(None if latency == 0 else latency - 1
+                              for latency in latencies)
+        error = Exception(self.string()) if flags & HAS_ERROR else None
+        node = None
+        if flags & HAS_NODE:
+            node = dict(self.fields(state['node']))
+        if not flags & SAME_NEIGHBORS:
+            state['polled'] = self.neighbors(state)
+            state['clock'] = state['time'] / 1000.0
+        return Snapshot(seq=0,
+                        url=url,
+                        time=state['time'] / 1000.0,
+                        clock=state['clock'],
+                        node=node,
+                        neighbors=state['polled'],
+                        duration=duration,
+                        latencies=latencies,
+                        error=error)
+
+    def neighbors(self, state):
+        prev = state['neighbors']
+        current = {}
+        neighbors = []
+        for _ in range(self.varint()):
+            address = self.string()
+            flags = self.varint()
+            changes = [unzigzag(self.varint()) if flags & (1 << i) else 0
+                       for i in range(len(COUNTERS))]
+            last = prev.get(address)
+            if last is None:
+                values = changes
+                deltas = [0] * len(COUNTERS)
+                last = [None, None, None, {}]
+            else:
+                deltas = [d + c for d, c in zip(last[1], changes)]
+                values = [v + d for v, d in zip(last[0], deltas)]
+            kind = self.string() if flags & NEW_TYPE else last[2]
+            extra = self.fields(last[3]) if flags & NEW_FIELDS else last[3]
+            current[address] = [values, deltas, kind, extra]
+
+            neighbor = dict(extra)
+            neighbor['address'] = address
+            neighbor['connectionType'] = kind
+            neighbor.update(zip(COUNTERS, values))
+            neighbors.append(neighbor)
+        state['neighbors'] = current
+        return tuple(neighbors)
+
+
+class Recorder:
+
+    """
+    Appends every snapshot of the watched pollers to a session file.
+
+    Pollers only queue their snapshots; a writer thread encodes them
+    and appends one compressed block per RECORD_INTERVAL seconds of
+    polls, so recording never holds up polling. Blocks decode on their
+    own, which is what lets a Recording seek without reading the
+    blocks before it. A crash loses at most the block being filled.
+    """
+
+    def __init__(self, filename, interval=RECORD_INTERVAL):
+        self.filename = filename
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.blocks = 0
+        self.frames = 0
+        self.bytes = 0
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def watch(self, poller):
+        poller.subscribe(self.queue.put)
+
+    def start(self):
+        if path.isfile(self.filename) and path.getsize(self.filename) > 0:
+            with open(self.filename, 'rb') as f:
+                if f.read(len(RECORD_MAGIC)) != RECORD_MAGIC:
+                    raise ValueError("%s is not an iritop recording" %
+                                     self.filename)
+        self.file = open(self.filename, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(RECORD_MAGIC)
+        self._thread.start()
+
+    def stop(self):
+        self.queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        encoder = None
+        try:
+            while True:
+                snapshot = self.queue.get()
+                if snapshot is None:
+                    break
+                if encoder is None:
+                    encoder = BlockEncoder()
+                encoder.frame(snapshot)
+                if encoder.end - encoder.start >= self.interval * 1000:
+                    self.write(encoder)
+                    encoder = None
+            if encoder is not None:
+                self.write(encoder)
+        finally:
+            self.file.close()
+
+    def write(self, encoder):
+        block = encoder.block()
+        self.file.write(block)
+        self.file.flush()
+        self.blocks += 1
+        self.frames += encoder.frames
+        self.bytes += len(block)
+
+
+class Recording:
+
+    """
+    Reads a session file. Opening it only reads the block headers, so
+    the index of blocks is built without decoding any polls.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        if self.file.read(len(RECORD_MAGIC)) != RECORD_MAGIC:
+            raise ValueError("%s is not an iritop recording" % filename)
+        self.blocks = []
+        while True:
+            header = self.header()
+            if header is None:
+                break
+            offset = self.file.tell()
+            self.file.seek(header[-1], 1)
+
+            """ Ignore a block cut short by a crash """
+            if self.file.tell() > path.getsize(filename):
+                break
+            start, span, first, lag, frames, length = header
+            self.blocks.append(Block(offset, start, start + span, first,
+                                     first + lag, frames, length))
+        if not self.blocks:
+            raise ValueError("%s holds no polls" % filename)
+        self.start_time = self.blocks[0].start / 1000.0
+
+    def header(self):
+        values = []
+        value = shift = 0
+        while len(values) < 6:
+            byte = self.file.read(1)
+            if not byte:
+                return None
+            byte = ord(byte)
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if byte < 0x80:
+                values.append(value)
+                value = shift = 0
+        return values
+
+    def close(self):
+        self.file.close()
+
+    def position(self, time=None, milestone=None):
+        """ Number of the block holding a time or milestone index """
+        if time is not None:
+            keys, target = [b.end for b in self.blocks], time * 1000
+        else:
+            keys, target = [b.last_milestone for b in self.blocks], milestone
+        return min(bisect.bisect_left(keys, target), len(self.blocks) - 1)
+
+    def snapshots(self, first=0):
+        """ Yield the recorded snapshots from block number first on """
+        seq = 0
+        for block in self.blocks[first:]:
+            self.file.seek(block.offset)
+            decoder = BlockDecoder(self.file.read(block.length))
+            for snapshot in decoder.frames(block.start):
+                seq += 1
+                yield snapshot._replace(seq=seq)
+
+
+class JsonLinesRecording:
+
+    """
+    Reads a JSON Lines capture as a Recording: either the --headless
+    jsonl output, or raw getNodeInfo and getNeighbors responses, one
+    per line. Opening it only notes where each line starts; positions
+    are found by bisecting the lines, decoding a few dozen of them.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        self.offsets = array(INT_TYPECODE)
+        offset = 0
+        for line in self.file:
+            if line.strip():
+                self.offsets.append(offset)
+            offset += len(line)
+        first = next(self.snapshots(), None)
+        if first is None:
+            raise ValueError("%s holds no polls" % filename)
+        self.start_time = first.time
+
+    def close(self):
+        self.file.close()
+
+    def line(self, number):
+        self.file.seek(self.offsets[number])
+        return json.loads(self.file.readline().decode('utf-8'))
+
+    def key(self, number, time):
+        """ Time or milestone of the first poll from line number on """
+        for record in (self.line(n) for n in
+                       range(number, min(number + 4, len(self.offsets)))):
+            node = record.get('nodeInfo') if 'nodeInfo' in record \
+                else record if 'appName' in record else None
+            if node is None:
+                continue
+            if not time:
+                return node.get('latestMilestoneIndex')
+            return record['time'] if 'nodeInfo' in record \
+                else node.get('time', 0) / 1000.0
+        return None
+
+    def position(self, time=None, milestone=None):
+        """ Number of the line a time or milestone index starts at """
+        target = time if time is not None else milestone
+        low, high = 0, len(self.offsets)
+        while low < high:
+            middle = (low + high) // 2
+            key = self.key(middle, time is not None)
+            if key is None or key < target:
+                low = middle + 1
+            else:
+                high = middle
+
+        """ Back up one line, the other half of a pair of responses """
+        return max(0, min(low, len(self.offsets) - 1) - 1)
+
+    def snapshots(self, first=0):
+        """ Yield the captured snapshots from line number first on """
+        seq = 0
+        clock = None
+        responses = {}
+        for number in range(first, len(self.offsets)):
+            record = self.line(number)
+            if 'nodeInfo' in record:
+                seq += 1
+                snapshot = self.headless(seq, record)
+
+                """ Neighbors not polled this time repeat the last ones """
+                if record['latencies'].get('getNeighbors', 0) is None and \
+                        clock is not None:
+                    snapshot = snapshot._replace(clock=clock)
+                clock = snapshot.clock
+                yield snapshot
+                continue
+
+            if 'appName' in record:
+                responses['node'] = record
+            elif 'neighbors' in record:
+                responses['neighbors'] = record
+            if len(responses) == 2:
+                seq += 1
+                node = responses['node']
+                yield Snapshot(seq=seq,
+                               url=self.filename,
+                               time=node.get('time', 0) / 1000.0,
+                               clock=node.get('time', 0) / 1000.0,
+                               node=node,
+                               neighbors=tuple(
+                                   responses['neighbors']['neighbors']),
+                               duration=node.get('duration', 0),
+                               latencies=(0,) * len(COMMANDS),
+                               error=None)
+                responses = {}
+
+    @staticmethod
+    def headless(seq, record):
+        neighbors = tuple(dict((k, v) for k, v in neighbor.items()
+                               if not k.endswith('Delta'))
+                          for neighbor in record['neighbors'])
+        return Snapshot(seq=seq,
+                        url=record['node'],
+                        time=record['time'],
+                        clock=record['time'],
+                        node=record['nodeInfo'],
+                        neighbors=neighbors,
+                        duration=record['duration'],
+                        latencies=tuple(record['latencies'].get(
+                            command['command'], 0) for command in COMMANDS),
+                        error=None if record['error'] is None
+                        else Exception(record['error']))
+
+
+def open_recording(filename):
+    """ Open a session file or a JSON Lines capture """
+    with open(filename, 'rb') as f:
+        magic = f.read(len(RECORD_MAGIC))
+    if magic == RECORD_MAGIC:
+        return Recording(filename)
+    return JsonLinesRecording(filename)
+
+
+class Replayer:
+
+    """
+    Plays a recording back in place of a Poller: the recorded
+    snapshots of one node are published at speed times the pace they
+    were polled at, against a replay clock. Seeking looks the position
+    up in the recording's index, so only the part it lands in is
+    decoded. Recorded failures count as failed polls, as the Poller
+    counts them.
+
+    node picks the node of a fleet recording. A recording of a single
+    node plays whatever node is given, raw response captures are
+    named after their file rather than a node.
+    """
+
+    def __init__(self, recording, speed=REPLAY_SPEED, node=None):
+        self.recording = recording
+        self.speed = speed
+        self.start_time = recording.start_time
+        self.urls = self.recorded_urls(recording)
+        if not self.urls:
+            recording.close()
+            raise ValueError("The recording holds no polls")
+        self.url = self.urls[0]
+        if node is not None and len(self.urls) > 1:
+            if node not in self.urls:
+                recording.close()
+                raise ValueError("node %s not in recording, available: %s" %
+                                 (node, ", ".join(self.urls)))
+            self.url = node
+        self.seq = 0
+        self.snapshot = None
+        self.failures = 0
+        self.errors = 0
+        self.last_error = None
+        self.listeners = []
+        self.fetching = False
+        self.finished = False
+        self.next_poll = self.start_time
+        self.target = (self.start_time, None)
+        self.origin = self.start_time
+        self.wall = time.time()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    @staticmethod
+    def recorded_urls(recording):
+        """
+        Nodes polled in the first RECORD_INTERVAL seconds, which a fleet
+        recording polls every node in
+        """
+        urls = []
+        for snapshot in recording.snapshots():
+            if snapshot.time > recording.start_time + RECORD_INTERVAL:
+                break
+            if snapshot.url not in urls:
+                urls.append(snapshot.url)
+        return urls
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.recording.close()
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    @property
+    def tripped(self):
+        """ True where the recorded node's circuit breaker was open """
+        return self.failures >= BREAKER_FAILURES
+
+    def now(self):
+        """ The replay clock, which stops at the end of the recording """
+        with self._lock:
+            if self.finished:
+                return self.origin
+            return self.origin + (time.time() - self.wall) * self.speed
+
+    def seek(self, time=None, milestone=None):
+        """ Continue playing from a time or milestone index """
+        with self._lock:
+            self.target = (time, milestone)
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            with self._lock:
+                target, self.target = self.target, None
+            if target is None:
+                self._wake.wait()
+                continue
+            self.play(*target)
+
+    def play(self, when, milestone):
+        first = self.recording.position(time=when, milestone=milestone)
+        started = False
+        last = None
+        for snapshot in self.recording.snapshots(first):
+            if snapshot.url != self.url:
+                continue
+
+            """ Failures keep the last good data, as the Poller does """
+            if snapshot.node is None and last is not None:
+                snapshot = snapshot._replace(node=last.node,
+                                             neighbors=last.neighbors,
+                                             clock=last.clock)
+            if snapshot.node is not None:
+                last = snapshot
+
+            if not started:
+                if when is not None and snapshot.time < when:
+                    continue
+                if (milestone is not None and
+                        (snapshot.node or {}).get('latestMilestoneIndex',
+                                                  0) < milestone):
+                    continue
+                started = True
+                with self._lock:
+                    self.finished = False
+                    self.origin, self.wall = snapshot.time, time.time()
+
+            self.next_poll = snapshot.time
+            while True:
+                if self._stop.is_set() or self.target is not None:
+                    return
+                delay = (snapshot.time - self.now()) / self.speed
+                if delay <= 0:
+                    break
+                self._wake.wait(delay)
+            self.publish(snapshot)
+
+        with self._lock:
+            if self.snapshot is not None:
+                self.origin = self.snapshot.time
+            self.finished = True
+
+    def publish(self, snapshot):
+        if snapshot.error is not None:
+            self.failures += 1
+            self.errors += 1
+            self.last_error = snapshot.error
+        else:
+            self.failures = 0
+        self.seq += 1
+        self.snapshot = snapshot._replace(seq=self.seq)
+        for listener in self.listeners:
+            listener(self.snapshot)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""\
+Renderer benchmarks
+
+Draws IriTop frames into an off-screen terminal for synthetic sets of
+neighbors and reports, per frame, the time spent in historizer(),
+sorting and show_neighbors(), the bytes written to the terminal and
+the memory allocated. Results are stored as JSON, so runs of two
+versions can be compared:
+
+    python tests/benchmark_render.py --output before.json
+    python tests/benchmark_render.py --compare before.json
+"""
+from __future__ import print_function
+import argparse
+import platform
+import time
+import json
+import sys
+from os import (path, environ)
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # python 2
+
+try:
+    from io import StringIO
+except ImportError:
+    from cStringIO import StringIO  # python 2
+
+from blessed import Terminal
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import iritop  # noqa
+from fake_iri import (Neighbor, iritop_args)  # noqa
+
+SIZES = [10, 100, 1000, 10000]
+FRAMES = 20
+PHASES = ['historizer', 'sort', 'show_neighbors', 'flush']
+
+# Flag phases that got this much slower than the compared run
+REGRESSION = 1.1
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='IRITop renderer benchmarks')
+    parser.add_argument('--sizes', type=lambda s: [int(n) for n in
+                                                   s.split(',')],
+                        default=SIZES,
+                        help="Neighbor counts. Default: %s" %
+                             ','.join(str(n) for n in SIZES))
+    parser.add_argument('--frames', type=int, default=FRAMES,
+                        help="Frames per neighbor count. Default: %s" %
+                             FRAMES)
+    parser.add_argument('--output', type=str,
+                        help="Write the results to this JSON file")
+    parser.add_argument('--compare', type=str,
+                        help="Compare with the results in this JSON file")
+    return parser.parse_args()
+
+
+def iri_top(size):
+    """ IriTop drawing into an off-screen 160x50 terminal """
+    args = iritop_args('-p', '1', '-s', '2', '--max-tracked-neighbors',
+                       str(max(size, 10000)))
+    term = Terminal(kind='xterm-256color', stream=StringIO(),
+                    force_styling=True)
+    return iritop.IriTop(args, term=term)
+
+
+def frame(top, data):
+    """ Draw one frame, return the seconds each phase took """
+    times = {}
+
+    start = clock()
+    top.historizer(data)
+    times['historizer'] = clock() - start
+
+    start = clock()
+    top.table.sorted_rows(top.sortcolumn, True)
+    times['sort'] = clock() - start
+
+    start = clock()
+    top.show_neighbors(8)
+    times['show_neighbors'] = clock() - start
+
+    start = clock()
+    top.screen.flush()
+    times['flush'] = clock() - start
+    return times
+
+
+def allocations(top, data):
+    """ Peak and retained bytes allocated by each phase """
+    phases = [('historizer', lambda: top.historizer(data)),
+              ('sort', lambda: top.table.sorted_rows(top.sortcolumn, True)),
+              ('show_neighbors', lambda: top.show_neighbors(8)),
+              ('flush', top.screen.flush)]
+    result = {}
+    for name, phase in phases:
+        tracemalloc.start()
+        phase()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result[name] = {'peak_bytes': peak, 'retained_bytes': current}
+    return result
+
+
+def bench(size, frames):
+    top = iri_top(size)
+    neighbors = [Neighbor(n) for n in range(size)]
+
+    """ First frame draws the whole screen, later ones only changes """
+    frame(top, [n.get_data() for n in neighbors])
+    first_bytes = top.screen.frame_bytes
+
+    times = dict((phase, []) for phase in PHASES)
+    frame_bytes = []
+    for _ in range(frames):
+        data = [n.get_data() for n in neighbors]
+        for phase, seconds in frame(top, data).items():
+            times[phase].append(seconds)
+        frame_bytes.append(top.screen.frame_bytes)
+
+    result = {'phases': dict((phase, {'mean_ms': 1000 * sum(t) / len(t),
+                                      'min_ms': 1000 * min(t),
+                                      'max_ms': 1000 * max(t)})
+                             for phase, t in times.items()),
+              'frame_ms': 1000 * sum(sum(t) for t in times.values()) /
+              frames,
+              'first_frame_bytes': first_bytes,
+              'frame_bytes': sum(frame_bytes) / len(frame_bytes)}
+
+    if tracemalloc is not None:
+        for phase, alloc in allocations(
+                top, [n.get_data() for n in neighbors]).items():
+            result['phases'][phase].update(alloc)
+    return result
+
+
+def report(results, baseline=None):
+    print("%8s  %-15s %10s %10s %12s %12s" % ('size', 'phase', 'mean ms',
+                                              'max ms', 'peak bytes',
+                                              'vs compare'))
+    for size, result in sorted(results['sizes'].items(),
+                               key=lambda item: int(item[0])):
+        for phase in PHASES:
+            stats = result['phases'][phase]
+            ratio = ''
+            if baseline is not None and size in baseline['sizes']:
+                before = baseline['sizes'][size]['phases'][phase]['mean_ms']
+                if before > 0:
+                    ratio = "%.2fx" % (stats['mean_ms'] / before)
+                    if stats['mean_ms'] / before > REGRESSION:
+                        ratio += ' !'
+            print("%8s  %-15s %10.3f %10.3f %12s %12s" %
+                  (size, phase, stats['mean_ms'], stats['max_ms'],
+                   stats.get('peak_bytes', '-'), ratio))
+        print("%8s  %-15s %10.3f %10s %12s   first frame %d bytes,"
+              " then %d bytes/frame" %
+              (size, 'frame', result['frame_ms'], '', '',
+               result['first_frame_bytes'], result['frame_bytes']))
+
+
+def main():
+    args = parse_args()
+
+    # Fixed terminal size, whatever runs the benchmark
+    environ['LINES'], environ['COLUMNS'] = '50', '160'
+
+    results = {'version': iritop.__VERSION__,
+               'python': platform.python_version(),
+               'time': time.time(),
+               'frames': args.frames,
+               'sizes': {}}
+    for size in args.sizes:
+        results['sizes'][str(size)] = bench(size, args.frames)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""\
+Startup benchmarks
+
+Launches iritop in a fresh interpreter the way scripts do, and reports
+the wall time of importing the module, of --version and --help, and of
+a one poll headless run against a local fake node, along with the
+modules each run loaded that only some modes need. Results are stored
+as JSON, so runs of two versions can be compared:
+
+    python tests/benchmark_startup.py --output before.json
+    python tests/benchmark_startup.py --compare before.json
+"""
+from __future__ import print_function
+import argparse
+import platform
+import subprocess
+import threading
+import time
+import json
+import sys
+from os import (path, environ)
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import iritop  # noqa
+from fake_iri import (testHTTPServer, is_open)  # noqa
+
+IRITOP = path.join(path.dirname(path.dirname(path.abspath(__file__))),
+                   'iritop.py')
+RUNS = 10
+
+# Modules only some modes need, reported when a run loads them
+OPTIONAL = ['yaml', 'urllib3', 'blessed', 'curses', 'http.server',
+            'subprocess']
+
+# Flag runs that got this much slower than the compared run
+REGRESSION = 1.1
+
+clock = getattr(time, 'perf_counter', time.time)
+
+# Runs iritop.main() and lists the optional modules it loaded on exit
+LAUNCHER = '''\
+import atexit, sys
+sys.path.insert(0, %r)
+sys.argv = ['iritop'] + sys.argv[1:]
+atexit.register(lambda: sys.stderr.write('\\nMODULES %%s\\n' %% ','.join(
+    m for m in %r if m in sys.modules)))
+import iritop
+if len(sys.argv) > 1:
+    iritop.main()
+''' % (path.dirname(IRITOP), OPTIONAL)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='IRITop startup benchmarks')
+    parser.add_argument('--runs', type=int, default=RUNS,
+                        help="Launches per case. Default: %s" % RUNS)
+    parser.add_argument('--output', type=str,
+                        help="Write the results to this JSON file")
+    parser.add_argument('--compare', type=str,
+                        help="Compare with the results in this JSON file")
+    return parser.parse_args()
+
+
+def start_node():
+    """ Fake node for the headless case, answering on a free port """
+    port = testHTTPServer.find_free_port()
+    server = testHTTPServer('127.0.0.1', port)
+    thread = threading.Thread(target=server.serve_until_shutdown)
+    thread.daemon = True
+    thread.start()
+    while not is_open('127.0.0.1', port):
+        time.sleep(0.1)
+    return 'http://127.0.0.1:%d' % port
+
+
+def cases(node):
+    return [('import', []),
+            ('--version', ['--version']),
+            ('--help', ['--help']),
+            ('headless', ['--headless', '--node', node, '-U', 'nobody',
+                          '-P', 'secret', '--output', path.devnull])]
+
+
+def launch(args):
+    """ Seconds one launch took and the optional modules it loaded """
+    env = dict(environ, MAX_CYCLES='1')
+    start = clock()
+    process = subprocess.Popen([sys.executable, '-c', LAUNCHER] + args,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, env=env)
+    _, err = process.communicate()
+    seconds = clock() - start
+    modules = []
+    for line in err.decode('utf-8', 'replace').splitlines():
+        if line.startswith('MODULES '):
+            modules = [m for m in line.split(' ', 1)[1].split(',') if m]
+    return seconds, modules
+
+
+def bench(args, runs):
+    times = []
+    for _ in range(runs):
+        seconds, modules = launch(args)
+        times.append(seconds)
+    times.sort()
+    return {'mean_ms': 1000 * sum(times) / len(times),
+            'median_ms': 1000 * times[len(times) // 2],
+            'min_ms': 1000 * times[0],
+            'max_ms': 1000 * times[-1],
+            'modules': modules}
+
+
+def report(results, baseline=None):
+    print("%-10s %10s %10s %10s %12s  %s" % ('case', 'median ms', 'min ms',
+                                             'max ms', 'vs compare',
+                                             'optional modules'))
+    for name, _ in cases(''):
+        stats = results['cases'][name]
+        ratio = ''
+        if baseline is not None and name in baseline['cases']:
+            before = baseline['cases'][name]['median_ms']
+            if before > 0:
+                ratio = "%.2fx" % (stats['median_ms'] / before)
+                if stats['median_ms'] / before > REGRESSION:
+                    ratio += ' !'
+        print("%-10s %10.1f %10.1f %10.1f %12s  %s" %
+              (name, stats['median_ms'], stats['min_ms'], stats['max_ms'],
+               ratio, ', '.join(stats['modules']) or '-'))
+
+
+def main():
+    args = parse_args()
+
+    results = {'version': iritop.__VERSION__,
+               'python': platform.python_version(),
+               'time': time.time(),
+               'runs': args.runs,
+               'cases': {}}
+    for name, case in cases(start_node()):
+        results['cases'][name] = bench(case, args.runs)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
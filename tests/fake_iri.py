@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+# flake8: noqa
+"""\
+Fake IRI node
+
+Answers getNodeInfo and getNeighbors like an IRI node, with counters
+that grow on every call. The tests run it in-process; run it on its
+own to try iritop, the exporter or a fleet against nodes that do
+not exist:
+
+    python tests/fake_iri.py --port 14265 --neighbors 30 \\
+        --latency 50 --jitter 20 --error-rate 0.01 --nodes 100
+
+The server is threaded, each fake node serves any number of clients
+at once.
+"""
+import argparse
+import base64
+import socket
+import logging
+import random
+import threading
+import time
+import json
+import sys
+from functools import wraps
+from contextlib import closing
+
+try:
+    from BaseHTTPServer import (BaseHTTPRequestHandler, HTTPServer)
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import (BaseHTTPRequestHandler, HTTPServer)  # python 3
+    from socketserver import ThreadingMixIn
+
+
+LOG = logging.getLogger(__name__)
+
+
+""" Check authentication wrapper """
+def check_auth(func):
+    @wraps(func)
+    def wrapped(inst, *args, **kw):
+
+        """ Allow anyone if authentication is off """
+        if inst.auth is None:
+            return func(inst, *args, **kw)
+
+        expected = 'Basic ' + base64.b64encode(
+            inst.auth.encode()).decode('ascii')
+        if inst.headers.get('Authorization') == expected:
+
+            """ Allow if Authorization successful """
+            LOG.debug("Client authenticated: %s" %
+                      inst.client_address[0])
+
+            return func(inst, *args, **kw)
+
+        else:
+            """ Deny on wrong user:password """
+            return inst.refuse(address=inst.client_address[0],
+                               reason='Failed authentication',
+                               code=403)
+    return wrapped
+
+
+""" Random Data Generators """
+def counted(f):
+    def wrapped(*args, **kwargs):
+        wrapped.calls += 1
+        return f(*args, **kwargs)
+    wrapped.calls = 1
+    return wrapped
+
+
+def increment(f):
+    def wrapped(*args, **kwargs):
+        args[0]._increment_data()
+        return f(*args, **kwargs)
+    return wrapped
+
+
+class Neighbor:
+
+    protocol = ('udp', 'tcp')
+
+    # Per call counter increase: low, high
+    rates = {"numberOfAllTransactions": (10, 200),
+             "numberOfInvalidTransactions": (0, 1),
+             "numberOfNewTransactions": (10, 200),
+             "numberOfRandomTransactionRequests": (1, 4),
+             "numberOfSentTransactions": (10, 500),
+             "numberOfStaleTransactions": (0, 2)}
+
+    def __init__(self, count, growth=1.0):
+        self.growth = growth
+        self.neighbor_data = {
+            "address": "someneighbor%d:%d" % (count, random.randint(21600, 25600)),
+            "connectionType": self.protocol[random.randint(0, 1)],
+            "numberOfAllTransactions": random.randint(100000, 200000),
+            "numberOfInvalidTransactions": random.randint(0, 3),
+            "numberOfNewTransactions": random.randint(10, 20000),
+            "numberOfRandomTransactionRequests": random.randint(100, 20000),
+            "numberOfSentTransactions": random.randint(100000, 200000),
+            "numberOfStaleTransactions": random.randint(100, 2000)
+        }
+
+    def _increment_data(self):
+        data = dict(self.neighbor_data)
+        for key, (low, high) in self.rates.items():
+            data[key] += random.randint(int(low * self.growth),
+                                        int(high * self.growth))
+        self.neighbor_data = data
+
+    @increment
+    def get_data(self):
+        return self.neighbor_data
+
+    def __str__(self):
+        return str(self.neighbor_data)
+
+
+class RandomNeighborDataGenerator():
+
+    def __init__(self, count=None, growth=1.0):
+        # Generate a random number of initial neighbors if not given
+        if count is None:
+            count = random.randint(1, 5)
+        self.growth = growth
+        self.added = count
+        self.neighbors = [Neighbor(n, growth) for n in range(1, count + 1)]
+
+    def rand_neighbors_count(self):
+        # Randominze increase or decrease of neighbors
+        if random.randint(0, 1) == 0 and len(self.neighbors) >= 2:
+            del self.neighbors[ random.randint(0, len(self.neighbors)-1) ]
+        else:
+            self.added += 1
+            self.neighbors.append(Neighbor(self.added, self.growth))
+
+    @counted
+    def get_data(self):
+        return [n.get_data() for n in self.neighbors]
+
+    def get_neighbors_count(self):
+        return len(self.neighbors)
+
+
+class RandomAPIDataGenerator():
+
+    def __init__(self, neighbors_count):
+        self.get_neighbors_count = neighbors_count
+        self.api_data = {
+            "appName": "IRI",
+            "appVersion": "1.5.6-RELEASE",
+            "coordinatorAddress": "KPWCHICGJZXKE9GSUDXZYUAPLHAKAHYHDXNP" +
+                                  "HENTERYMMBQOPSQIDENXKLKCEYCPVTZQLEEJ" +
+                                  "VYJZV9BWU",
+            "duration": 0,
+            "features": [
+                "snapshotPruning",
+                "dnsRefresher",
+                "zeroMessageQueue",
+                "tipSolidification"
+            ],
+            "jreAvailableProcessors": 4,
+            "jreFreeMemory": random.randint(400000000, 600000000),
+            "jreMaxMemory": 3221225472,
+            "jreTotalMemory": random.randint(2000000000, 2500000000),
+            "jreVersion": "1.8.0_201",
+            "latestMilestone": "WWUOHJKZHJRDTIYSGYRIEUFCOJIJYGZJNPMRVNP" +
+                               "OWQPOJAOGORXYRTWTPDXKLUJQ99YVUPKGZJXO" +
+                               "99999",
+            "latestMilestoneIndex": 933210,
+            "latestSolidSubtangleMilestone": "KRNMNTGO9RWUJRQQKFTXVVX9K" +
+                                             "LAHQQSJGCJYTNIPUSGODMMOUW" +
+                                             "ZLNAEUJE9APAGSMUDAGQPJVNH" +
+                                             "V99999",
+            "latestSolidSubtangleMilestoneIndex": 933210,
+            "milestoneStartIndex": 933210,
+            "neighbors": self.get_neighbors_count(),
+            "packetsQueueSize": 0,
+            "time": int(round(time.time() * 1000)),
+            "tips": random.randint(1000, 5000),
+            "transactionsToRequest": random.randint(0, 100)
+        }
+
+    def _increment_data(self):
+        self.api_data['jreFreeMemory'] = random.randint(400000000, 600000000)
+        self.api_data['jreTotalMemory'] = random.randint(2000000000, 2500000000)
+        self.api_data['latestMilestoneIndex'] += 1
+        self.api_data['latestSolidSubtangleMilestoneIndex'] += 1
+        self.api_data['neighbors'] = self.get_neighbors_count()
+        self.api_data['time'] = int(round(time.time() * 1000))
+        self.api_data['tips'] = random.randint(1000, 5000)
+        self.api_data['transactionsToRequest'] = random.randint(0, 100)
+
+    @increment
+    def get_data(self):
+        return self.api_data
+
+
+""" Handler for HTTP Server requests """
+class HTTPHandler(BaseHTTPRequestHandler):
+
+    # Keep-alive, like the IRI API
+    protocol_version = 'HTTP/1.1'
+
+    neighbor_data = RandomNeighborDataGenerator()
+    api_data = RandomAPIDataGenerator(
+            neighbor_data.get_neighbors_count)
+
+    # Behaviour, see fake_node() to change it
+    auth = 'nobody:secret'
+    latency = 0
+    jitter = 0
+    error_rate = 0
+    churn = 0.2
+    lock = threading.Lock()
+
+    def refuse(self, address=None, reason=None, code=401):
+        LOG.warning("HTTP: Client refused with '%s': %s" %
+                    (reason, address))
+        response = {}
+        if address is not None:
+            response['unauthorized'] = address
+
+        if reason is not None:
+            response['reason'] = reason
+
+        self.do_response(response=response, code=401)
+
+    @check_auth
+    def do_POST(self):
+        """ Simple POST router """
+        if self.path == '/':
+            content_len = int(self.headers.get('content-length'))
+            post_body = self.rfile.read(content_len)
+            data = json.loads(post_body.decode('ascii'))
+            self._process_data(data)
+        else:
+            self.do_response(code=404)
+
+    def _process_data(self, data):
+        code = 200
+
+        LOG.debug("Server got data: '%s'" % data)
+        if 'command' not in data:
+            self.do_response(response={"error": "missing command"}, code=400)
+            return
+
+        # Slow node
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+        # Failing node
+        if self.error_rate and random.random() < self.error_rate:
+            self.do_response(response={"error": "injected failure"},
+                             code=500)
+            return
+
+        # Optionally increment data values here to
+        # help mimic real API port query over time
+        with self.lock:
+            if data['command'] == 'getNeighbors':
+                if random.random() < self.churn:
+                    LOG.debug("Increase or decrease neighbor count")
+                    self.neighbor_data.rand_neighbors_count()
+                response = {"duration": 0,
+                            "neighbors": self.neighbor_data.get_data()}
+            elif data['command'] == 'getNodeInfo':
+                response = self.api_data.get_data()
+            else:
+                response = {"error": "invalid command"}
+                code = 400
+            body = json.dumps(response).encode()
+
+        self.do_response(code=code, body=body)
+
+    def do_response(self, response=None, code=200, body=None):
+        if body is None:
+            body = json.dumps(response).encode()
+        self._set_headers(code, len(body))
+        self.wfile.write(body)
+
+    def _set_headers(self, code, length):
+        self.send_response(code)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        return
+
+
+def fake_node(neighbors=None, growth=1.0, latency=0, jitter=0,
+              error_rate=0, churn=0.2, auth='nobody:secret'):
+    """ Handler class for a node with its own neighbors and behaviour """
+    neighbor_data = RandomNeighborDataGenerator(neighbors, growth)
+    return type('FakeNodeHandler', (HTTPHandler,), {
+        'neighbor_data': neighbor_data,
+        'api_data': RandomAPIDataGenerator(
+            neighbor_data.get_neighbors_count),
+        'auth': auth,
+        'latency': latency,
+        'jitter': jitter,
+        'error_rate': error_rate,
+        'churn': churn,
+        'lock': threading.Lock()})
+
+
+""" HTTP test server """
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    # Room for hundreds of clients connecting at once
+    request_queue_size = 1024
+
+
+class testHTTPServer():
+
+    def __init__(self, bind_address, bind_port, handler=HTTPHandler):
+        self.server_address = (bind_address, bind_port)
+        self.handler = handler
+
+    def serve_until_shutdown(self):
+        self.httpd = ThreadingHTTPServer(self.server_address, self.handler)
+        self.httpd.serve_forever()
+
+    @staticmethod
+    def find_free_port():
+        with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
+            s.bind(('', 0))
+            return s.getsockname()[1]
+
+
+def is_open(ip, port):
+    # TODO: See how to supress warning
+    # 'ResourceWarning: unclosed <socket.socket...'
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.connect((ip, int(port)))
+        s.shutdown(2)
+        return True
+    except Exception:
+        return False
+
+
+def iritop_args(*argv, **overrides):
+    """
+    Arguments of an iritop run as its parse_args() fills them in from
+    argv, without reading ~/.iritop, and then set by keyword
+    """
+    import iritop
+    args = iritop.parse_args(list(argv))
+    for key, value in overrides.items():
+        setattr(args, key, value)
+    return args
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Fake IRI node')
+    parser.add_argument('--bind', default='127.0.0.1',
+                        help="Address to listen on. Default: 127.0.0.1")
+    parser.add_argument('--port', type=int, default=14265,
+                        help="Port of the first node. Default: 14265")
+    parser.add_argument('--nodes', type=int, default=1,
+                        help="Nodes to run, on consecutive ports."
+                             " Default: 1")
+    parser.add_argument('--neighbors', type=int,
+                        help="Neighbors per node. Default: random 1-5")
+    parser.add_argument('--growth', type=float, default=1.0,
+                        help="Counter growth factor. Default: 1")
+    parser.add_argument('--latency', type=float, default=0,
+                        help="Response delay in ms. Default: 0")
+    parser.add_argument('--jitter', type=float, default=0,
+                        help="Random +/- ms on the delay. Default: 0")
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help="Share of calls answered with HTTP 500."
+                             " Default: 0")
+    parser.add_argument('--churn', type=float, default=0.2,
+                        help="Chance a getNeighbors call adds or drops a"
+                             " neighbor. Default: 0.2")
+    parser.add_argument('--auth', default=None,
+                        help="Require basic auth as user:password."
+                             " Default: Off")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(stream=sys.stderr,
+                        format='[%(levelname)s] %(message)s')
+
+    servers = []
+    for port in range(args.port, args.port + args.nodes):
+        handler = fake_node(neighbors=args.neighbors, growth=args.growth,
+                            latency=args.latency, jitter=args.jitter,
+                            error_rate=args.error_rate, churn=args.churn,
+                            auth=args.auth)
+        server = ThreadingHTTPServer((args.bind, port), handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        servers.append(server)
+        print("Fake IRI node on http://%s:%d" % (args.bind, port))
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
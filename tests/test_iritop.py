@@ -1,23 +1,24 @@
 # flake8: noqa
 
-import socket
 import threading
 import unittest
 import logging
 import random
 import time
 import json
+import socket
+import pstats
+import csv
+import errno
 import sys
-from os import (path, environ)
-from functools import wraps
+import shutil
+import subprocess
+import tempfile
+import urllib3
+from os import (path, environ, remove)
 from blessed import Terminal
-from contextlib import (contextmanager, closing)
-
+from contextlib import contextmanager
 
-try:
-    from BaseHTTPServer import (BaseHTTPRequestHandler, HTTPServer)
-except ImportError:
-    from http.server import (BaseHTTPRequestHandler, HTTPServer)  # python 3
 
 try:
     from cStringIO import StringIO
@@ -28,6 +29,8 @@ except ImportError:
 sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
 
 import iritop # noqa
+from fake_iri import (HTTPHandler, Neighbor, testHTTPServer,  # noqa
+                      is_open, fake_node, iritop_args)
 
 LOG = logging.getLogger(__name__)
 
@@ -89,6 +92,16 @@ class TestArgParser(unittest.TestCase):
                 LOG.info("Testing invalid URL: '%s'" % node)
                 self.set_new_args(['--node=' + node])
 
+    def test_multiple_nodes(self):
+        """
+        Test repeated --node arguments
+        """
+        nodes = ['http://localhost:12345', 'https://10.30.40.50:12345']
+        self.set_new_args(['--node=' + nodes[0], '--node=' + nodes[1]])
+        self.assertEqual(self.args.nodes, nodes)
+        self.assertEqual(self.args.node, nodes[0])
+        self.assertEqual(self.args.workers, 2)
+
     def test_return_version_string(self):
         """
         Test return Version string and exit
@@ -99,6 +112,58 @@ class TestArgParser(unittest.TestCase):
                 output = out.getvalue().strip()
                 self.assertEqual(output, 'iritop ' + iritop.__VERSION__)
 
+    def test_version_skips_heavy_imports(self):
+        """
+        Test --version and --help load none of the optional modules
+        """
+        script = ("import sys; sys.path.insert(0, %r); import iritop\n"
+                  "try:\n"
+                  "    iritop.main()\n"
+                  "except SystemExit:\n"
+                  "    pass\n"
+                  "sys.stderr.write(','.join(m for m in ['yaml', 'urllib3',"
+                  " 'blessed', 'curses', 'subprocess'] if m in sys.modules))"
+                  % path.dirname(path.dirname(path.abspath(__file__))))
+        for arg in ['--version', '--help']:
+            process = subprocess.Popen([sys.executable, '-c', script, arg],
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE)
+            out, err = process.communicate()
+            self.assertTrue(out)
+            self.assertEqual(err.decode('utf-8'), '')
+
+    def test_local_node(self):
+        """
+        Test local addresses are looked up in-process, once, without
+        resolving names, and not at all for loopback nodes
+        """
+        def no_lookups(*args):
+            raise AssertionError("name lookup")
+        getaddrinfo = socket.getaddrinfo
+        socket.getaddrinfo = no_lookups
+        iritop.LOCAL_ADDRESSES = None
+        try:
+            self.set_new_args(['--node=http://[::1]:14265'])
+            self.assertTrue(iritop.IriTop(self.args).localhost)
+            self.set_new_args(['--node=http://127.0.0.1:14265'])
+            self.assertTrue(iritop.IriTop(self.args).localhost)
+            self.assertIsNone(iritop.LOCAL_ADDRESSES)
+
+            addresses = iritop.local_addresses()
+        finally:
+            socket.getaddrinfo = getaddrinfo
+        self.assertIn('127.0.0.1', addresses)
+        self.assertIn(socket.gethostname().lower(), addresses)
+        self.assertTrue(iritop.interface_addresses() <= addresses)
+        self.assertIs(iritop.local_addresses(), addresses)
+
+        self.set_new_args(['--node=http://203.0.113.250:14265'])
+        self.assertFalse(iritop.IriTop(self.args).localhost)
+        for address in iritop.interface_addresses():
+            host = '[%s]' % address if ':' in address else address
+            self.set_new_args(['--node=http://%s:14265' % host])
+            self.assertTrue(iritop.IriTop(self.args).localhost)
+
     def test_config_file_not_found(self):
         """
         Test file not found error
@@ -151,15 +216,6 @@ class TestFetchData(unittest.TestCase):
     # Could opt for a way to bring up the server
     # for the entire duration of the class test
     def setUp(self):
-        args = {
-            'poll_delay': 1,
-            'blink_delay': 0.5,
-            'obscure_address': False,
-            'test': False,  # Remove?
-            'password': 'secret',
-            'username': 'nobody',
-            'sort': 3
-        }
 
         """ Get free port and set node address """
         self.free_port = testHTTPServer.find_free_port()
@@ -177,7 +233,9 @@ class TestFetchData(unittest.TestCase):
             time.sleep(0.2)
 
         """ IRITop instance """
-        self.iri_top = iritop.IriTop(Struct(**args))
+        self.iri_top = iritop.IriTop(iritop_args('-p', '1', '-s', '3',
+                                                 '-U', 'nobody',
+                                                 '-P', 'secret'))
 
     def start_server(self):
         self.server_thread = threading.Thread(
@@ -206,6 +264,174 @@ class TestFetchData(unittest.TestCase):
             result = iritop.fetch_data({'command': 'invalid'})
             result = result
 
+    def test_connections_reused(self):
+        client = iritop.NodeClient(iritop.NODE)
+        for _ in range(5):
+            result = client.fetch({'command': 'getNodeInfo'})
+            self.assertIn('appName', result[0])
+
+        """ Steady-state polling reuses the keep-alive connection """
+        self.assertEqual(client.connections_opened, 1)
+        self.assertEqual(client.connections_reused, 4)
+
+    def test_fetch_all(self):
+        commands = [{'command': 'getNeighbors'}, {'command': 'getNodeInfo'}]
+        results, latencies = self.iri_top.client.fetch_all(commands)
+
+        """ Results and latencies are returned in command order """
+        self.assertIn('neighbors', results[0][0])
+        self.assertIn('appName', results[1][0])
+        self.assertEqual(len(latencies), 2)
+
+    def test_poller_snapshot(self):
+        poller = iritop.Poller(self.iri_top.client,
+                               self.iri_top.commands, 1)
+        poller.start()
+        try:
+            while poller.snapshot is None:
+                time.sleep(0.1)
+        finally:
+            poller.stop()
+
+        snapshot = poller.snapshot
+        self.assertIsNone(snapshot.error)
+        self.assertIn('appName', snapshot.node)
+        self.assertIsInstance(snapshot.neighbors, tuple)
+
+    def test_fleet_poller(self):
+        nodes = [iritop.NODE, 'http://localhost:%d' % self.free_port]
+        clients = [iritop.NodeClient(node) for node in nodes]
+        fleet = iritop.FleetPoller(clients, iritop.COMMANDS, 1, workers=2)
+        fleet.start()
+        try:
+            while any(p.snapshot is None for p in fleet.pollers.values()):
+                time.sleep(0.1)
+        finally:
+            fleet.stop()
+
+        """ Every node got polled and published its own snapshot """
+        self.assertEqual(list(fleet.pollers.keys()), nodes)
+        for poller in fleet.pollers.values():
+            self.assertIn('appName', poller.snapshot.node)
+
+    def headless(self, fmt, stream=None):
+        args = iritop_args('--headless', '--format', fmt, '-p', '1',
+                           '-U', 'nobody', '-P', 'secret')
+        stream = StringIO() if stream is None else stream
+        iritop.MAX_CYCLES = 2
+        iritop.Headless(args, stream=stream).run()
+        return stream.getvalue()
+
+    def test_headless_jsonl(self):
+        records = [json.loads(line)
+                   for line in self.headless('jsonl').splitlines()]
+
+        """ One record per poll, neighbors extended with deltas """
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]['node'], iritop.NODE)
+        self.assertIn('appName', records[0]['nodeInfo'])
+        neighbor = records[1]['neighbors'][0]
+        for key in iritop.COUNTERS:
+            self.assertIn(key + 'Delta', neighbor)
+
+    def test_headless_csv(self):
+        rows = list(csv.reader(StringIO(self.headless('csv'))))
+
+        """ Header then one row per neighbor per poll """
+        self.assertEqual(rows[0], iritop.Headless.csv_header())
+        self.assertTrue(len(rows) > 2)
+        self.assertTrue(all(len(row) == len(rows[0]) for row in rows))
+
+    def test_headless_reader_went_away(self):
+        class ClosedPipe(StringIO):
+            def write(self, s):
+                raise IOError(errno.EPIPE, 'Broken pipe')
+
+        """ Exits at the first write instead of polling on """
+        start = time.time()
+        with captured_output() as (out, err):
+            self.headless('jsonl', stream=ClosedPipe())
+        self.assertEqual(err.getvalue(), '')
+        self.assertTrue(time.time() - start < 2)
+
+    def test_failing_listener_is_reported(self):
+        poller = iritop.Poller(self.iri_top.client,
+                               self.iri_top.commands, 1)
+        seen = []
+
+        def fail(snapshot):
+            raise ValueError('bad listener')
+        poller.subscribe(fail)
+        poller.subscribe(seen.append)
+        with captured_output() as (out, err):
+            poller.poll()
+
+        """ Later listeners still get the snapshot """
+        self.assertEqual(len(seen), 1)
+        self.assertIn('bad listener', err.getvalue())
+
+    def test_worker_survives_a_failing_job(self):
+        pool = iritop.WorkerPool(1)
+        done = threading.Event()
+        with captured_output() as (out, err):
+            pool.submit(lambda: 1 / 0)
+            pool.submit(done.set)
+            self.assertTrue(done.wait(5))
+        pool.stop()
+        self.assertIn('ZeroDivisionError', err.getvalue())
+
+    def test_profile(self):
+        directory = tempfile.mkdtemp()
+        filename = path.join(directory, 'iritop.prof')
+        args = iritop_args('--headless', '-p', '1', '-U', 'nobody',
+                           '-P', 'secret', '--profile', filename,
+                           '--output', path.join(directory, 'out.jsonl'))
+        iritop.MAX_CYCLES = 2
+        try:
+            iritop.profile(args)
+
+            """ pstats of the run and collapsed stacks of every thread """
+            stats = pstats.Stats(filename)
+            self.assertIn('run', [func[2] for func in stats.stats
+                                  if func[0].endswith('iritop.py')])
+            with open(filename + '.folded') as f:
+                lines = f.read().splitlines()
+            self.assertTrue(lines)
+            for line in lines:
+                stack, count = line.rsplit(' ', 1)
+                self.assertTrue(int(count) > 0)
+            self.assertTrue(any(';_run (iritop.py' in line
+                                for line in lines))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_exporter_serves_cached_snapshot(self):
+        poller = iritop.Poller(self.iri_top.client,
+                               self.iri_top.commands, 1)
+        exporter = iritop.Exporter(0, address='127.0.0.1')
+        exporter.watch(poller)
+        exporter.start()
+        try:
+            poller.poll()
+            calls = HTTPHandler.neighbor_data.get_data.calls
+            http = urllib3.PoolManager()
+            for _ in range(3):
+                response = http.request(
+                    'GET', 'http://127.0.0.1:%d/metrics' % exporter.port)
+        finally:
+            exporter.stop()
+
+        """ Scrapes never reach the node """
+        self.assertEqual(HTTPHandler.neighbor_data.get_data.calls, calls)
+        self.assertEqual(exporter.scrapes, 3)
+
+        body = response.data.decode('utf-8')
+        self.assertIn('iri_up{node="%s"} 1' % iritop.NODE, body)
+        self.assertIn('iri_latest_milestone_index{', body)
+        self.assertIn('iri_neighbor_all_transactions_total{', body)
+        self.assertIn('iritop_fetch_duration_seconds_count{node="%s",'
+                      'command="getNodeInfo"} 1' % iritop.NODE, body)
+
     def test_run_for_a_while(self):
         iritop.MAX_CYCLES = 10
 
@@ -213,6 +439,625 @@ class TestFetchData(unittest.TestCase):
         self.assertEqual(self.iri_top.run(FakeSCR), None)
 
 
+class TestFakeIRI(unittest.TestCase):
+
+    def serve(self, handler):
+        port = testHTTPServer.find_free_port()
+        server = testHTTPServer('127.0.0.1', port, handler)
+        thread = threading.Thread(target=server.serve_until_shutdown)
+        thread.daemon = True
+        thread.start()
+        while not is_open('127.0.0.1', port):
+            time.sleep(0.05)
+        self.addCleanup(lambda: server.httpd.shutdown())
+        return iritop.NodeClient('http://127.0.0.1:%d' % port)
+
+    def test_neighbors_and_latency(self):
+        client = self.serve(fake_node(neighbors=30, churn=0, latency=100,
+                                      auth=None))
+        results, latencies = client.fetch_all(iritop.COMMANDS)
+
+        self.assertEqual(len(results[0][0]['neighbors']), 30)
+        self.assertTrue(all(latency >= 100 for latency in latencies))
+
+    def test_errors_and_auth(self):
+        client = self.serve(fake_node(error_rate=1, auth=None))
+        with self.assertRaises(Exception):
+            client.fetch({'command': 'getNodeInfo'})
+
+        """ Wrong credentials are refused """
+        client = self.serve(fake_node(auth='somebody:else'))
+        with self.assertRaises(Exception):
+            client.fetch({'command': 'getNodeInfo'})
+
+    def test_poll_intervals(self):
+        client = self.serve(fake_node(neighbors=3, churn=0, auth=None))
+        poller = iritop.Poller(client, iritop.COMMANDS, 1,
+                               {'getNeighbors': 5})
+        first = poller.poll()
+        self.assertEqual(poller.due_commands(first.time + 2), [1])
+
+        """ Only getNodeInfo was polled, the neighbors are carried over """
+        second = poller.poll([1])
+        self.assertIsNone(second.latencies[0])
+        self.assertIsNotNone(second.latencies[1])
+        self.assertEqual(second.neighbors, first.neighbors)
+        self.assertEqual(second.clock, first.clock)
+
+    def test_circuit_breaker(self):
+        handler = fake_node(error_rate=1, auth=None)
+        poller = iritop.Poller(self.serve(handler), iritop.COMMANDS, 1)
+        for _ in range(iritop.BREAKER_FAILURES):
+            self.assertFalse(poller.tripped)
+            poller.poll()
+
+        """ Once open, a single command at a time probes the node """
+        self.assertTrue(poller.tripped)
+        self.assertEqual(len(poller.due_commands(time.time() + 3600)), 1)
+        self.assertEqual(poller.due[0], poller.due[1])
+
+        """ And the others follow as soon as it answers """
+        handler.error_rate = 0
+        probe = poller.poll(poller.due_commands(time.time() + 3600))
+        self.assertIsNone(probe.error)
+        self.assertFalse(poller.tripped)
+        self.assertEqual(len(poller.due_commands(time.time())), 1)
+        self.assertEqual(poller.errors, iritop.BREAKER_FAILURES)
+
+    def test_poll_backoff(self):
+        handler = fake_node(error_rate=1, auth=None)
+        poller = iritop.Poller(self.serve(handler), iritop.COMMANDS, 1)
+        backoff = []
+        for _ in range(8):
+            self.assertIsNotNone(poller.poll().error)
+            backoff.append(poller.backoff[0])
+
+        """ Failing commands back off exponentially up to BACKOFF_MAX """
+        self.assertEqual(backoff[:3], [2, 4, 8])
+        self.assertEqual(backoff[-1], iritop.BACKOFF_MAX)
+        self.assertGreater(poller.next_poll, time.time() + 1)
+
+        """ And speed up again once the node recovers """
+        handler.error_rate = 0
+        self.assertIsNone(poller.poll().error)
+        self.assertEqual(poller.backoff[0], iritop.BACKOFF_MAX / 2)
+        for _ in range(6):
+            poller.poll()
+        self.assertEqual(poller.backoff, [1, 1])
+
+
+class TestScreen(unittest.TestCase):
+
+    def setUp(self):
+        self.out = StringIO()
+        self.term = Terminal(kind='xterm-256color', stream=self.out,
+                             force_styling=True)
+        self.screen = iritop.Screen(self.term)
+
+    def frame(self, segments):
+        self.out.seek(0)
+        self.out.truncate()
+        for row, col, text in segments:
+            self.screen.put(row, col, text)
+        self.screen.flush()
+        return self.out.getvalue()
+
+    def test_unchanged_frame_writes_nothing(self):
+        segments = [(0, 0, 'title'), (1, 0, 'label:'), (1, 18, '42')]
+        self.assertIn('title', self.frame(segments))
+        self.assertEqual(self.frame(segments), '')
+
+    def test_only_changed_segments_are_written(self):
+        self.frame([(1, 0, 'label:'), (1, 18, '42'), (2, 0, 'other')])
+        output = self.frame([(1, 0, 'label:'), (1, 18, '43'),
+                             (2, 0, 'other')])
+        self.assertIn('43', output)
+        self.assertNotIn('label:', output)
+        self.assertNotIn('other', output)
+
+    def test_frame_stats(self):
+        output = self.frame([(0, 0, 'title'), (1, 0, 'label:')])
+        self.assertTrue(output.startswith(iritop.SYNC_BEGIN))
+        self.assertTrue(output.endswith(iritop.SYNC_END))
+        self.assertEqual(self.screen.frame_writes, 1)
+        self.assertEqual(self.screen.frame_bytes, len(output))
+
+        self.frame([(0, 0, 'title'), (1, 0, 'label:')])
+        self.assertEqual(self.screen.frame_writes, 0)
+        self.assertEqual(self.screen.frame_bytes, 0)
+        self.assertEqual(self.screen.frames, 2)
+        self.assertEqual(self.screen.writes, 1)
+
+    def test_removed_segments_are_blanked(self):
+        self.frame([(1, 0, 'label:'), (1, 18, '12345')])
+        output = self.frame([(1, 0, 'label:'), (1, 18, '1')])
+        self.assertIn(' ' * 5, output)
+        self.assertIn('label:', output)
+
+    def test_styles_match_the_terminal(self):
+        styles = iritop.Styles(self.term)
+        nested = self.term.red('!') + ' value'
+        for name in styles.NAMES:
+            for text in ['value', nested]:
+                self.assertEqual(getattr(styles, name)(text),
+                                 getattr(self.term, name)(text))
+
+    def test_layout(self):
+        layout = iritop.Layout(50, 160, 'Q to exit')
+        self.assertEqual(layout.info[1], (53, 71))
+        self.assertEqual(layout.column_starts[:3], [0, 24, 41])
+        self.assertEqual(layout.address_width, 54)
+        self.assertEqual(len(layout.footer), 160)
+
+    def test_events(self):
+        events = iritop.Events(self.term)
+        with events:
+            self.assertTrue(events.changed((0, 0)))
+            self.assertFalse(events.signal and events.changed((0, 0)))
+
+            """ A snapshot or a resize ends the wait, timers as well """
+            events.wake()
+            self.assertEqual(events.wait(), '')
+            events.handle(None, None)
+            events.wait()
+            self.assertTrue(events.changed((0, 0)))
+            events.after(0.01)
+            events.wait()
+        self.assertEqual(list(events.wakeups.values()), [0, 1, 1, 1])
+        self.assertIn('3 wakeups', events.stats())
+
+    def test_moves_are_cached_until_clear(self):
+        self.frame([(1, 18, '42')])
+        self.assertIn((1, 18), self.screen.moves)
+        self.screen.clear()
+        self.assertEqual(self.screen.moves, {})
+
+
+class TestNeighborTable(unittest.TestCase):
+
+    def setUp(self):
+        args = iritop_args('-p', '1', '--neighbor-ttl', '3')
+        self.term = Terminal(kind='xterm-256color', stream=StringIO(),
+                             force_styling=True)
+        self.iri_top = iritop.IriTop(args, term=self.term)
+
+    def neighbors(self, count):
+        neighbors = [Neighbor(n).neighbor_data for n in range(count)]
+        self.iri_top.historizer(neighbors)
+        return neighbors
+
+    def test_only_visible_rows_are_formatted(self):
+        self.neighbors(100)
+        self.iri_top.show_neighbors(8)
+
+        page_size = self.iri_top.page_size
+        self.assertLess(page_size, 100)
+
+        """ All rows are tracked, including the ones off-screen """
+        table = self.iri_top.table
+        for c in range(len(table.counters)):
+            self.assertEqual(list(table.drawn[c]), list(table.current[c]))
+
+    def test_scroll_is_clamped(self):
+        self.neighbors(100)
+        self.iri_top.scroll = 1000
+        self.iri_top.show_neighbors(8)
+        self.assertEqual(self.iri_top.scroll,
+                         100 - self.iri_top.page_size)
+
+    def test_historizer_delta(self):
+        neighbors = self.neighbors(3)
+        table = self.iri_top.table
+        c = table.index['numberOfAllTransactions']
+
+        """ Deltas count from the second poll of a neighbor """
+        self.assertEqual(list(table.delta[c]), [0, 0, 0])
+        polled = [dict(n) for n in neighbors[1:]]
+        for neighbor in polled:
+            neighbor['numberOfAllTransactions'] += 10
+        self.iri_top.historizer(polled)
+
+        self.assertEqual(table.rows, [1, 2])
+        self.assertEqual(list(table.delta[c]), [0, 10, 10])
+
+        """ The raw neighbor data is left untouched """
+        self.assertEqual(set(neighbors[0].keys()),
+                         set(Neighbor(0).neighbor_data.keys()))
+
+    def test_rates_use_poll_time(self):
+        neighbors = [Neighbor(n).neighbor_data for n in range(2)]
+        table = self.iri_top.table
+        c = table.index['numberOfAllTransactions']
+        self.iri_top.historizer(neighbors, now=100.0)
+
+        """ Same delta over twice the time is half the rate """
+        for elapsed, now in ((2, 102.0), (4, 106.0)):
+            neighbors = [dict(n) for n in neighbors]
+            for neighbor in neighbors:
+                neighbor['numberOfAllTransactions'] += 20
+            self.iri_top.historizer(neighbors, now=now)
+            self.assertEqual(list(table.rate[c]), [20.0 / elapsed] * 2)
+
+        """ Averages start at the first rate, then move towards it """
+        average = table.average['1m'][c][0]
+        self.assertTrue(5.0 < average < 10.0)
+        self.assertTrue(average < table.average['15m'][c][0] < 10.0)
+
+    def test_sort_by_rate(self):
+        neighbors = [Neighbor(n).neighbor_data for n in range(3)]
+        self.iri_top.historizer(neighbors, now=0.0)
+        neighbors = [dict(n) for n in neighbors]
+        for n, neighbor in enumerate(neighbors):
+            neighbor['numberOfAllTransactions'] += [5, 50, 20][n]
+        self.iri_top.historizer(neighbors, now=1.0)
+
+        self.assertEqual(self.iri_top.table.sorted_rows(
+            'numberOfAllTransactions', True, '5m'), [1, 2, 0])
+
+        """ Rate mode shows tx/s """
+        self.iri_top.rate_mode = 1
+        c = self.iri_top.all_tx
+        self.assertEqual(self.iri_top.txString(1, c, 8).strip(), '50.0')
+
+    def test_absent_neighbors_are_evicted(self):
+        neighbors = self.neighbors(3)
+        table = self.iri_top.table
+        for _ in range(3):
+            self.iri_top.historizer(neighbors[:1])
+        self.assertEqual(len(table), 3)
+
+        self.iri_top.historizer(neighbors[:1])
+        self.assertEqual(len(table), 1)
+        self.assertEqual(table.evicted, 2)
+
+        """ Freed slots are reused """
+        self.iri_top.historizer(neighbors[:2])
+        self.assertEqual(len(table.addresses), 3)
+
+    def test_max_tracked_neighbors(self):
+        table = self.iri_top.table
+        table.max_tracked = 5
+        self.neighbors(5)
+
+        """ The neighbor seen longest ago makes room """
+        self.iri_top.historizer([Neighbor(9).neighbor_data])
+        self.assertEqual(len(table), 5)
+        self.assertEqual(table.evicted, 1)
+
+        """ Neighbors of a single poll beyond the max are not tracked """
+        self.neighbors(7)
+        self.assertEqual(len(table), 5)
+        self.assertEqual(table.untracked, 2)
+
+    def test_missing_counters_default_to_zero(self):
+        self.iri_top.historizer([{'address': 'a:1', 'connectionType': 'tcp'}])
+        table = self.iri_top.table
+        self.assertEqual([column[0] for column in table.current],
+                         [0] * len(table.counters))
+
+
+class TestRollingStats(unittest.TestCase):
+
+    def test_quantiles_and_max(self):
+        stats = iritop.RollingStats()
+        for i in range(1, 101):
+            stats.add(i, now=i)
+
+        summary = stats.summaries['15m']
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['max'], 100)
+        self.assertEqual(summary['mean'], 50)
+
+        """ Quantiles are estimated within 10% """
+        self.assertAlmostEqual(summary['p50'], 50, delta=5)
+        self.assertAlmostEqual(summary['p95'], 95, delta=10)
+        self.assertAlmostEqual(summary['p99'], 99, delta=10)
+
+    def test_old_samples_expire(self):
+        stats = iritop.RollingStats()
+        stats.add(5000, now=0)
+        for i in range(1, 121):
+            stats.add(10, now=i)
+
+        """ The spike left the 1 minute window, not the 5 minute one """
+        self.assertEqual(stats.summaries['1m']['max'], 10)
+        self.assertEqual(stats.summaries['1m']['count'], 61)
+        self.assertEqual(stats.summaries['5m']['max'], 5000)
+
+    def test_windows_span_time_not_samples(self):
+        stats = iritop.RollingStats()
+        stats.add(5000, now=0)
+        for i in range(1, 401):
+            stats.add(10, now=i * 0.5)
+
+        """ Samples faster than the poll delay still cover 5 minutes """
+        self.assertEqual(stats.summaries['5m']['max'], 5000)
+        self.assertEqual(stats.summaries['5m']['count'], 401)
+
+        stats.add(10, now=301)
+        self.assertEqual(stats.summaries['5m']['max'], 10)
+        self.assertEqual(stats.summaries['15m']['max'], 5000)
+
+    def test_ring_capacity(self):
+        window = iritop.LatencyWindow(window=60, capacity=10)
+        for i in range(100):
+            window.add(i, now=0)
+        self.assertEqual(window.summary()['count'], 10)
+        self.assertEqual(window.summary()['max'], 99)
+        self.assertEqual(window.total, sum(range(90, 100)))
+
+
+class TestTimings(unittest.TestCase):
+
+    def test_phases(self):
+        timings = iritop.Timings()
+        for _ in range(3):
+            timings.add('sort', iritop.monotonic() - 0.01)
+        report = timings.report()
+        self.assertEqual(report['sort']['count'], 3)
+        self.assertTrue(report['sort']['mean_ms'] >= 10)
+        self.assertIn('sort ', timings.summary(['sort', 'write']))
+
+        """ Dumped as JSON on exit """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = path.join(directory, 'timings.json')
+        timings.dump(filename)
+        with open(filename) as f:
+            self.assertEqual(json.load(f)['sort']['count'], 3)
+
+    def test_frame_is_timed(self):
+        args = iritop_args('-p', '1', '-s', '2', '--neighbor-ttl', '3')
+        term = Terminal(kind='xterm-256color', stream=StringIO(),
+                        force_styling=True)
+        iri_top = iritop.IriTop(args, term=term)
+        iritop.TIMINGS = timings = iritop.Timings()
+        self.addCleanup(setattr, iritop, 'TIMINGS', iritop.Timings())
+
+        iri_top.historizer([Neighbor(n).get_data() for n in range(5)])
+        iri_top.show_neighbors(8)
+        iri_top.screen.flush()
+        self.assertEqual(list(timings.report().keys()),
+                         ['counters', 'historizer', 'sort', 'write'])
+
+
+class SessionFiles:
+
+    """ Helpers for tests on session files """
+
+    def setUp(self):
+        self.filename = path.join(tempfile.mkdtemp(), 'session.rec')
+
+    def tearDown(self):
+        shutil.rmtree(path.dirname(self.filename))
+
+    def snapshots(self, polls):
+        node = dict(HTTPHandler.api_data.api_data)
+        counters = [1000, 50, 900, 5, 0, 2]
+        for seq in range(1, polls + 1):
+            counters = [c + random.randint(0, 30) for c in counters]
+            node = dict(node, latestMilestoneIndex=100 + seq // 3,
+                        tips=random.randint(0, 5000))
+            neighbors = [dict(zip(iritop.COUNTERS, counters),
+                              address='a%d:15600' % n, connectionType='tcp')
+                         for n in range(3) if n != seq % 4]
+            if seq % 5 == 0:
+                neighbors[0]['connected'] = False
+            yield iritop.Snapshot(seq=seq, url='http://n:14265',
+                                  time=1000.0 + seq, clock=1000.0 + seq,
+                                  node=node,
+                                  neighbors=tuple(neighbors), duration=seq,
+                                  latencies=(seq, 2), error=None)
+
+    def record(self, snapshots):
+        recorder = iritop.Recorder(self.filename, interval=10)
+        recorder.start()
+        for snapshot in snapshots:
+            recorder.queue.put(snapshot)
+        recorder.stop()
+        return recorder
+
+
+class TestRecording(SessionFiles, unittest.TestCase):
+
+    def test_round_trip(self):
+        snapshots = list(self.snapshots(50))
+        snapshots[20] = snapshots[20]._replace(node=None, neighbors=(),
+                                               error=Exception('down'))
+        snapshots[30] = snapshots[30]._replace(
+            neighbors=snapshots[29].neighbors, clock=snapshots[29].clock,
+            latencies=(None, 5))
+        recorder = self.record(snapshots)
+
+        recording = iritop.Recording(self.filename)
+        self.assertEqual(len(recording.blocks), recorder.blocks)
+        replayed = list(recording.snapshots())
+        recording.close()
+
+        """ Every poll comes back as it was recorded """
+        self.assertEqual(len(replayed), len(snapshots))
+        for recorded, snapshot in zip(replayed, snapshots):
+            self.assertEqual(recorded.node, snapshot.node)
+            self.assertEqual(list(recorded.neighbors),
+                             list(snapshot.neighbors))
+            self.assertEqual(recorded.latencies, snapshot.latencies)
+            self.assertAlmostEqual(recorded.time, snapshot.time)
+        self.assertEqual(str(replayed[20].error), 'down')
+
+        """ A poll that skipped getNeighbors keeps the neighbors' clock """
+        self.assertEqual(replayed[30].clock, replayed[29].clock)
+
+    def test_bytes_per_snapshot(self):
+        """
+        10 minutes of a 30-neighbor node polled every 2s: about 27 bytes
+        a poll (1.2 MB a day) when each neighbor's counters grow at a
+        steady rate, about 200 bytes (8.7 MB a day) when they grow by a
+        random 0-30 every poll
+        """
+        rng = random.Random(13)
+        node = dict(HTTPHandler.api_data.api_data)
+        rates = [[rng.randint(0, 30) for _ in iritop.COUNTERS]
+                 for _ in range(30)]
+        for steady, limit in [(True, 40), (False, 260)]:
+            counters = [[1000] * len(iritop.COUNTERS) for _ in range(30)]
+            snapshots = []
+            for seq in range(1, 301):
+                for n in range(30):
+                    counters[n] = [c + (r if steady else rng.randint(0, 30))
+                                   for c, r in zip(counters[n], rates[n])]
+                node = dict(node, latestMilestoneIndex=100 + seq // 30,
+                            tips=rng.randint(0, 5000))
+                neighbors = tuple(dict(zip(iritop.COUNTERS, counters[n]),
+                                       address='10.0.0.%d:15600' % n,
+                                       connectionType='tcp')
+                                  for n in range(30))
+                snapshots.append(iritop.Snapshot(
+                    seq=seq, url='http://n:14265', time=1000.0 + 2 * seq,
+                    clock=1000.0 + 2 * seq, node=node, neighbors=neighbors,
+                    duration=5, latencies=(5, 3), error=None))
+
+            recorder = iritop.Recorder(self.filename)
+            recorder.start()
+            for snapshot in snapshots:
+                recorder.queue.put(snapshot)
+            recorder.stop()
+            self.assertTrue(recorder.bytes / len(snapshots) < limit)
+            remove(self.filename)
+
+    def test_truncated_block_is_ignored(self):
+        recorder = self.record(self.snapshots(50))
+        with open(self.filename, 'ab') as f:
+            f.truncate(path.getsize(self.filename) - 1)
+
+        recording = iritop.Recording(self.filename)
+        recording.close()
+        self.assertEqual(len(recording.blocks), recorder.blocks - 1)
+
+
+class TestReplay(SessionFiles, unittest.TestCase):
+
+    def setUp(self):
+        SessionFiles.setUp(self)
+        self.recorded = list(self.snapshots(50))
+        self.record(self.recorded)
+
+    def replay(self, recording, **target):
+        replayer = iritop.Replayer(recording)
+        if target:
+            replayer.seek(**target)
+        replayer.start()
+        try:
+            while replayer.snapshot is None:
+                time.sleep(0.01)
+        finally:
+            replayer.stop()
+        return replayer.snapshot
+
+    def test_seek(self):
+        recording = iritop.Recording(self.filename)
+
+        """ The index points at the block, frames before it are skipped """
+        block = recording.position(milestone=110)
+        self.assertTrue(recording.blocks[block].first_milestone <= 110 <=
+                        recording.blocks[block].last_milestone)
+        snapshot = self.replay(recording, milestone=110)
+        self.assertEqual(snapshot.node['latestMilestoneIndex'], 110)
+        self.assertEqual(snapshot.seq, 1)
+
+        """ Stopping the replay closed the recording """
+        self.assertTrue(recording.file.closed)
+
+        recording = iritop.Recording(self.filename)
+        snapshot = self.replay(recording, time=recording.start_time + 30)
+        self.assertAlmostEqual(snapshot.time, self.recorded[30].time)
+
+    def test_json_lines(self):
+        capture = self.filename + '.jsonl'
+        with open(capture, 'w') as f:
+            for snapshot in self.recorded:
+                f.write(json.dumps({'neighbors': snapshot.neighbors}) + "\n")
+                f.write(json.dumps(dict(snapshot.node,
+                                        time=snapshot.time * 1000)) + "\n")
+
+        recording = iritop.open_recording(capture)
+        self.assertIsInstance(recording, iritop.JsonLinesRecording)
+        self.assertEqual(len(list(recording.snapshots())),
+                         len(self.recorded))
+        snapshot = self.replay(recording, milestone=110)
+        self.assertEqual(snapshot.node['latestMilestoneIndex'], 110)
+        self.assertEqual(list(snapshot.neighbors),
+                         list(self.recorded[30].neighbors))
+
+        """ A capture of one node plays whichever node is configured """
+        replayer = iritop.Replayer(iritop.open_recording(capture),
+                                   node=iritop.NODE)
+        replayer.stop()
+        self.assertEqual(replayer.url, capture)
+
+    def test_pick_node_of_fleet(self):
+        remove(self.filename)
+        snapshots = []
+        for snapshot in self.snapshots(20):
+            snapshots.append(snapshot)
+            snapshots.append(snapshot._replace(url='http://m:14265'))
+        self.record(snapshots)
+
+        replayer = iritop.Replayer(iritop.Recording(self.filename),
+                                   node='http://m:14265')
+        replayer.stop()
+        self.assertEqual(replayer.urls, ['http://n:14265', 'http://m:14265'])
+        self.assertEqual(replayer.url, 'http://m:14265')
+
+        with self.assertRaises(ValueError) as raised:
+            iritop.Replayer(iritop.Recording(self.filename),
+                            node='http://o:14265')
+        self.assertIn('available: http://n:14265, http://m:14265',
+                      str(raised.exception))
+
+    def view(self, cycles, speed=1000):
+        """ Terminal view of the recording, after a number of polls """
+        args = iritop_args('-p', '1', '-b', '0.01', '--neighbor-ttl', '3')
+        term = Terminal(kind='xterm-256color', stream=StringIO(),
+                        force_styling=True)
+        replayer = iritop.Replayer(iritop.Recording(self.filename),
+                                   speed=speed)
+        iri_top = iritop.IriTop(args, node=replayer.url, term=term,
+                                poller=replayer)
+        iritop.MAX_CYCLES = cycles
+
+        self.assertEqual(iri_top.run(FakeSCR), None)
+        return iri_top
+
+    def test_replay_drives_the_view(self):
+        """ Slow enough for the view to see 10 polls before the end """
+        iri_top = self.view(10, speed=100)
+        self.assertEqual(iri_top.table.polls, 10)
+
+        """ No client and no Connections row without a node """
+        self.assertIsNone(iri_top.client)
+        output = iri_top.term.stream.getvalue()
+        self.assertIn('Neighbors', output)
+        self.assertNotIn('Connections', output)
+
+    def test_failed_polls_keep_the_view(self):
+        remove(self.filename)
+        snapshots = list(self.snapshots(10))
+        for i in (4, 5, 6):
+            snapshots[i] = snapshots[i]._replace(node=None, neighbors=(),
+                                                 error=Exception('down'))
+        self.record(snapshots)
+        iri_top = self.view(1000)
+
+        """ The view survives the failures and runs to the end """
+        replayer = iri_top.poller
+        self.assertTrue(replayer.finished)
+        self.assertEqual(replayer.errors, 3)
+        self.assertEqual(replayer.failures, 0)
+        self.assertEqual(str(replayer.last_error), 'down')
+        self.assertEqual(iri_top.good_time, snapshots[-1].time)
+        self.assertTrue(len(iri_top.table) > 0)
+
+
 class FakeSCR:
     @staticmethod
     def clear():
@@ -222,272 +1067,6 @@ class FakeSCR:
 # END TEST CASES
 
 
-def is_open(ip, port):
-    # TODO: See how to supress warning
-    # 'ResourceWarning: unclosed <socket.socket...'
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    try:
-        s.connect((ip, int(port)))
-        s.shutdown(2)
-        return True
-    except Exception:
-        return False
-
-
-""" Check authentication wrapper """
-def check_auth(func):
-    @wraps(func)
-    def wrapped(inst, *args, **kw):
-
-        # nobody:secret base64 encoded
-        if (inst.headers.get('Authorization') ==
-                'Basic bm9ib2R5OnNlY3JldA=='):
-
-            """ Allow if Authorization successful """
-            LOG.debug("Client authenticated: %s" %
-                      inst.client_address[0])
-
-            return func(inst, *args, **kw)
-
-        else:
-            """ Deny on wrong user:password """
-            return inst.refuse(address=inst.client_address[0],
-                               reason='Failed authentication',
-                               code=403)
-    return wrapped
-
-
-""" Random Data Generators """
-def counted(f):
-    def wrapped(*args, **kwargs):
-        wrapped.calls += 1
-        return f(*args, **kwargs)
-    wrapped.calls = 1
-    return wrapped
-
-
-def increment(f):
-    def wrapped(*args, **kwargs):
-        args[0]._increment_data()
-        return f(*args, **kwargs)
-    return wrapped
-
-
-class Neighbor:
-
-    protocol = ('udp', 'tcp')
-
-    def __init__(self, count):
-        self.neighbor_data = {
-            "address": "someneighbor%d:%d" % (count, random.randint(21600, 25600)),
-            "connectionType": self.protocol[random.randint(0, 1)],
-            "numberOfAllTransactions": random.randint(100000, 200000),
-            "numberOfInvalidTransactions": random.randint(0, 3),
-            "numberOfNewTransactions": random.randint(10, 20000),
-            "numberOfRandomTransactionRequests": random.randint(100, 20000),
-            "numberOfSentTransactions": random.randint(100000, 200000),
-            "numberOfStaleTransactions": random.randint(100, 2000)
-        }
-
-    def _increment_data(self):
-        self.neighbor_data = {
-            "address": self.neighbor_data['address'],
-            "connectionType": self.neighbor_data['connectionType'],
-            "numberOfAllTransactions": random.randint(
-                self.neighbor_data['numberOfAllTransactions'] + 10,
-                self.neighbor_data['numberOfAllTransactions'] + 200
-            ),
-            "numberOfInvalidTransactions": random.randint(
-                self.neighbor_data['numberOfInvalidTransactions'] + 0,
-                self.neighbor_data['numberOfInvalidTransactions'] + 1
-            ),
-            "numberOfNewTransactions": random.randint(
-                self.neighbor_data['numberOfNewTransactions'] + 10,
-                self.neighbor_data['numberOfNewTransactions'] + 200
-            ),
-            "numberOfRandomTransactionRequests": random.randint(
-                self.neighbor_data['numberOfRandomTransactionRequests'] + 1,
-                self.neighbor_data['numberOfRandomTransactionRequests'] + 4
-            ),
-            "numberOfSentTransactions": random.randint(
-                self.neighbor_data['numberOfSentTransactions'] + 10,
-                self.neighbor_data['numberOfSentTransactions'] + 500
-            ),
-            "numberOfStaleTransactions": random.randint(
-                self.neighbor_data['numberOfStaleTransactions'] + 0,
-                self.neighbor_data['numberOfStaleTransactions'] + 2
-            )
-        }
-
-    @increment
-    def get_data(self):
-        return self.neighbor_data
-
-    def __str__(self):
-        return str(self.neighbor_data)
-
-
-class RandomNeighborDataGenerator():
-
-    def __init__(self):
-        # Generate a random number of initial neighbors
-        self.neighbors = [Neighbor(n) for n in range(1, random.randint(2, 6))]
-
-    def rand_neighbors_count(self):
-        # Randominze increase or decrease of neighbors
-        if random.randint(0, 1) == 0 and len(self.neighbors) >= 2:
-            del self.neighbors[ random.randint(0, len(self.neighbors)-1) ]
-        else:
-            self.neighbors.append(Neighbor(len(self.neighbors) + 1))
-
-    @counted
-    def get_data(self):
-        return [n.get_data() for n in self.neighbors]
-
-    def get_neighbors_count(self):
-        return len(self.neighbors)
-
-
-class RandomAPIDataGenerator():
-
-    def __init__(self, neighbors_count):
-        self.get_neighbors_count = neighbors_count
-        self.api_data = {
-            "appName": "IRI",
-            "appVersion": "1.5.6-RELEASE",
-            "coordinatorAddress": "KPWCHICGJZXKE9GSUDXZYUAPLHAKAHYHDXNP" +
-                                  "HENTERYMMBQOPSQIDENXKLKCEYCPVTZQLEEJ" +
-                                  "VYJZV9BWU",
-            "duration": 0,
-            "features": [
-                "snapshotPruning",
-                "dnsRefresher",
-                "zeroMessageQueue",
-                "tipSolidification"
-            ],
-            "jreAvailableProcessors": 4,
-            "jreFreeMemory": random.randint(400000000, 600000000),
-            "jreMaxMemory": 3221225472,
-            "jreTotalMemory": random.randint(2000000000, 2500000000),
-            "jreVersion": "1.8.0_201",
-            "latestMilestone": "WWUOHJKZHJRDTIYSGYRIEUFCOJIJYGZJNPMRVNP" +
-                               "OWQPOJAOGORXYRTWTPDXKLUJQ99YVUPKGZJXO" +
-                               "99999",
-            "latestMilestoneIndex": 933210,
-            "latestSolidSubtangleMilestone": "KRNMNTGO9RWUJRQQKFTXVVX9K" +
-                                             "LAHQQSJGCJYTNIPUSGODMMOUW" +
-                                             "ZLNAEUJE9APAGSMUDAGQPJVNH" +
-                                             "V99999",
-            "latestSolidSubtangleMilestoneIndex": 933210,
-            "milestoneStartIndex": 933210,
-            "neighbors": self.get_neighbors_count(),
-            "packetsQueueSize": 0,
-            "time": int(round(time.time() * 1000)),
-            "tips": random.randint(1000, 5000),
-            "transactionsToRequest": random.randint(0, 100)
-        }
-
-    def _increment_data(self):
-        self.api_data['jreFreeMemory'] = random.randint(400000000, 600000000)
-        self.api_data['jreTotalMemory'] = random.randint(2000000000, 2500000000)
-        self.api_data['latestMilestoneIndex'] += 1
-        self.api_data['latestSolidSubtangleMilestoneIndex'] += 1
-        self.api_data['neighbors'] = self.get_neighbors_count()
-        self.api_data['time'] = int(round(time.time() * 1000))
-        self.api_data['tips'] = random.randint(1000, 5000)
-        self.api_data['transactionsToRequest'] = random.randint(0, 100)
-
-    @increment
-    def get_data(self):
-        return self.api_data
-
-
-""" Handler for HTTP Server requests """
-class HTTPHandler(BaseHTTPRequestHandler):
-
-    neighbor_data = RandomNeighborDataGenerator()
-    api_data = RandomAPIDataGenerator(
-            neighbor_data.get_neighbors_count)
-
-    def refuse(self, address=None, reason=None, code=401):
-        LOG.warning("HTTP: Client refused with '%s': %s" %
-                    (reason, address))
-        response = {}
-        if address is not None:
-            response['unauthorized'] = address
-
-        if reason is not None:
-            response['reason'] = reason
-
-        self.do_response(response=response, code=401)
-
-    @check_auth
-    def do_POST(self):
-        """ Simple POST router """
-        if self.path == '/':
-            content_len = int(self.headers.get('content-length'))
-            post_body = self.rfile.read(content_len)
-            data = json.loads(post_body.decode('ascii'))
-            self._process_data(data)
-        else:
-            self.do_response(code=404)
-
-    def _process_data(self, data):
-        code = 200
-
-        LOG.debug("Server got data: '%s'" % data)
-        if 'command' not in data:
-            self.do_response(response={"error": "missing command"}, code=400)
-
-        # Optionally increment data values here to
-        # help mimic real API port query over time
-        if data['command'] == 'getNeighbors':
-            if self.neighbor_data.get_data.calls % 5 == 0:
-                LOG.debug("Increase or decrease neighbor count")
-                self.neighbor_data.rand_neighbors_count()
-            response = {"duration": 0,
-                        "neighbors": self.neighbor_data.get_data()}
-        elif data['command'] == 'getNodeInfo':
-            response = self.api_data.get_data()
-        else:
-            response = {"error": "invalid command"}
-            code = 400
-
-        self.do_response(code=code, response=response)
-
-    def do_response(self, response=None, code=200):
-        self._set_headers(code)
-        self.wfile.write(json.dumps(response).encode())
-
-    def _set_headers(self, code):
-        self.send_response(code)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-
-    def log_message(self, format, *args):
-        return
-
-
-""" HTTP test server """
-
-
-class testHTTPServer():
-
-    def __init__(self, bind_address, bind_port):
-        self.server_address = (bind_address, bind_port)
-
-    def serve_until_shutdown(self):
-        self.httpd = HTTPServer(self.server_address, HTTPHandler)
-        while True:
-            self.httpd.handle_request()
-
-    @staticmethod
-    def find_free_port():
-        with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
-            s.bind(('', 0))
-            return s.getsockname()[1]
-
-
 @contextmanager
 def captured_output():
     """ Capture output context mgr """
@@ -500,12 +1079,6 @@ def captured_output():
         sys.stdout, sys.stderr = old_out, old_err
 
 
-class Struct:
-    """ Transform dict to namspace """
-    def __init__(self, **entries):
-        self.__dict__.update(entries)
-
-
 if __name__ == '__main__':
     logging.basicConfig(stream=sys.stderr,
                         format='[%(levelname)s] %(message)s')